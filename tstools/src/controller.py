@@ -24,6 +24,7 @@ from . import settings
 from .utils import actions
 from .logger import qgis_log
 from .ts_driver.ts_manager import tsm
+from .ts_driver.ts_utils import CancelToken, FetchCancelled
 
 logger = logging.getLogger('tstools')
 
@@ -33,14 +34,35 @@ logger = logging.getLogger('tstools')
 
 
 class Worker(QtCore.QObject):
+    """ Fetch data from a timeseries driver within a QThread
 
+    Data are fetched first (`retrieved`) and then, if the driver has
+    results, results are read or models are fit as a second stage
+    (`fit_started`, and `fit_errored` on failure) so data can be plotted
+    before results are ready. `finished` is sent once both stages are done.
+
+    Attributes:
+      cancel_token (CancelToken): token used to cancel the fetch from another
+        thread
+      fitting (bool): True once the worker may read or calculate results,
+        which cannot be cancelled
+
+    """
     update = QtCore.pyqtSignal(float)
+    streamed = QtCore.pyqtSignal(int, object)
+    retrieved = QtCore.pyqtSignal()
     finished = QtCore.pyqtSignal()
     errored = QtCore.pyqtSignal(str)
+    cancelled = QtCore.pyqtSignal()
+    fit_started = QtCore.pyqtSignal()
+    fit_errored = QtCore.pyqtSignal(str)
 
     def __init__(self, parent):
         super(Worker, self).__init__()
+        self.cancel_token = CancelToken()
+        self.fitting = False
         parent.fetch_data.connect(self.fetch)
+        parent.fit_results.connect(self.fit)
 
     @QtCore.pyqtSlot(object, object, str)
     def fetch(self, ts, pos, crs_wkt):
@@ -48,12 +70,44 @@ class Worker(QtCore.QObject):
                     hex(self.thread().currentThreadId()))
         # Fetch data
         try:
-            for percent in ts.fetch_data(pos[0], pos[1], crs_wkt):
+            for percent in ts.fetch_data(pos[0], pos[1], crs_wkt,
+                                         cancel=self.cancel_token,
+                                         publish=self.streamed.emit):
                 self.update.emit(percent)
+        except FetchCancelled:
+            logger.info('Fetch cancelled')
+            self.cancelled.emit()
+            return
         except Exception as e:
             self.errored.emit(e.message)
-        else:
-            self.finished.emit()
+            return
+        self.retrieved.emit()
+
+        # Read or calculate results once data are plotted. Flag fitting
+        # before checking for cancellation so that either the controller
+        # sees the flag or this worker sees the cancellation
+        if ts.has_results:
+            self.fitting = True
+            if not self.cancel_token.cancelled:
+                self._fit(ts)
+        self.finished.emit()
+
+    @QtCore.pyqtSlot(object)
+    def fit(self, ts):
+        """ Read or calculate results for data already fetched """
+        logger.info('Fitting from QThread (id: %s)' %
+                    hex(self.thread().currentThreadId()))
+        self.fitting = True
+        self._fit(ts)
+        self.finished.emit()
+
+    def _fit(self, ts):
+        self.fit_started.emit()
+        try:
+            ts.fetch_results()
+        except Exception as e:
+            logger.exception('Could not fetch results')
+            self.fit_errored.emit(e.message)
 
 
 class PlotHandler(QtCore.QObject):
@@ -146,10 +200,14 @@ class Controller(QtCore.QObject):
     controls = None
     plots = []
     working = False
+    streaming = False
+    fitting = False
     worker = None
+    _pending_request = None
     work_thread = None
 
     fetch_data = QtCore.pyqtSignal(object, object, str)
+    fit_results = QtCore.pyqtSignal(object)
 
     initialized = False
 
@@ -163,6 +221,9 @@ class Controller(QtCore.QObject):
     def get_timeseries(self, driver, location, custom_config=None):
         """ Initialize timeseries selected by user
         """
+        self.plot_request_stop()
+        if tsm.ts is not None:
+            tsm.ts.close()
         try:
             tsm.ts = driver(location, config=custom_config)
         except Exception as e:
@@ -196,6 +257,7 @@ class Controller(QtCore.QObject):
         self.controls.image_table_row_clicked.connect(self._add_remove_image)
         self.controls.symbology_applied.connect(
             lambda: actions.apply_symbology())
+        self.controls.custom_controls_applied.connect(self.apply_controls)
 
         # Setup plots
         self._init_plots()
@@ -205,116 +267,274 @@ class Controller(QtCore.QObject):
     @QtCore.pyqtSlot(object)
     def plot_request(self, pos):
         if self.working:
-            qgis_log('Unable to initiate plot request: already working',
-                     logging.INFO)
-        else:
-            qgis_log('Clicked a point: {p} ({t})'.format(p=pos, t=type(pos)),
+            self.worker.cancel_token.cancel()
+            # Model fitting can't be interrupted, so fetch once it finishes.
+            # The worker may start fitting before `fit_started` arrives
+            if self.fitting or self.worker.fitting:
+                logger.info('Queueing plot request until model is fit')
+                self._pending_request = pos
+                return
+            logger.info('Cancelling previous plot request')
+            self.plot_request_stop()
+
+        qgis_log('Clicked a point: {p} ({t})'.format(p=pos, t=type(pos)),
+                 level=logging.INFO)
+
+        crs = qgis.utils.iface.mapCanvas().mapRenderer().destinationCrs()
+        crs_wkt = crs.toWkt()
+
+        if not self._set_custom_controls():
+            return
+
+        self._plot_request_setup('Retrieving data')
+        self.work_thread.started.connect(partial(self.plot_request_start,
+                                         self.worker,
+                                         tsm.ts,
+                                         (pos[0], pos[1]),
+                                         crs_wkt))
+
+        # Run thread
+        logger.info('Timeseries (id: {i})'.format(i=hex(id(tsm.ts))))
+        logger.info('Current thread: ({i})'.format(
+            i=hex(self.thread().currentThreadId())))
+
+        self.work_thread.start()
+        logger.info('Started QThread (id: {i})'.format(
+            i=hex(self.work_thread.currentThreadId())))
+
+    @QtCore.pyqtSlot()
+    def apply_controls(self):
+        """ Read or calculate results again using the current custom controls
+
+        Only results are fetched again, using data already retrieved for the
+        current pixel, within the worker thread.
+        """
+        if not tsm.ts.has_results or not tsm.ts.pixel_pos:
+            qgis_log('Click a pixel before applying controls',
                      level=logging.INFO)
+            return
+        if self.working:
+            qgis_log('Cannot apply controls while a plot request is running',
+                     level=logging.WARNING)
+            return
 
-            crs = qgis.utils.iface.mapCanvas().mapRenderer().destinationCrs()
-            crs_wkt = crs.toWkt()
-
-            # Setup QProgressBar
-            self.progress_bar = qgis.utils.iface.messageBar().createMessage(
-                'Retrieving data')
-
-            self.progress = QtGui.QProgressBar()
-            self.progress.setValue(0)
-            self.progress.setMaximum(100)
-            self.progress.setAlignment(QtCore.Qt.AlignLeft |
-                                       QtCore.Qt.AlignVCenter)
-
-            self.but_cancel = QtGui.QPushButton('Cancel')
-            self.but_cancel.pressed.connect(self.plot_request_cancel)
-
-            self.progress_bar.layout().addWidget(self.progress)
-            self.progress_bar.layout().addWidget(self.but_cancel)
-
-            qgis.utils.iface.messageBar().pushWidget(
-                self.progress_bar, qgis.utils.iface.messageBar().INFO)
-
-            # Setup worker and thread
-            self.working = True
-
-            self.work_thread = QtCore.QThread()
-            # self.worker = Worker()
-            self.worker = Worker(self)
-            self.worker.moveToThread(self.work_thread)
-            self.worker.update.connect(self.plot_request_update)
-            self.worker.finished.connect(self.plot_request_finish)
-            self.worker.errored.connect(self.plot_request_error)
-            self.work_thread.started.connect(partial(self.plot_request_start,
-                                             tsm.ts,
-                                             (pos[0], pos[1]),
-                                             crs_wkt))
-
-            if (getattr(self.controls, 'custom_form', None) is not None and
-                    hasattr(tsm.ts, 'set_custom_controls')):
-                try:
-                    options = self.controls.custom_form.get()
-                    tsm.ts.set_custom_controls(options)
-                except Exception as e:
-                    logger.warning(
-                        'Could not use custom controls for timeseries')
-                    qgis_log(e.message, level=logging.WARNING)
-                    self.controls.custom_form.reset()
-                    return
-
-            # Run thread
-            logger.info('Timeseries (id: {i})'.format(i=hex(id(tsm.ts))))
-            logger.info('Current thread: ({i})'.format(
-                i=hex(self.thread().currentThreadId())))
-
-            self.work_thread.start()
-            logger.info('Started QThread (id: {i})'.format(
-                i=hex(self.work_thread.currentThreadId())))
-
-    @QtCore.pyqtSlot(object, tuple, str)
-    def plot_request_start(self, ts, pos, crs_wkt):
+        if not self._set_custom_controls():
+            return
+
+        self._plot_request_setup('Fitting model')
+        self.fitting = True
+        self.progress.setMaximum(0)
+        self.work_thread.started.connect(partial(self.fit_request_start,
+                                                 self.worker,
+                                                 tsm.ts))
+        self.work_thread.start()
+
+    def _set_custom_controls(self):
+        """ Set custom controls of the timeseries driver from the control form
+
+        Returns:
+          bool: False if controls could not be set
+
+        """
+        if (getattr(self.controls, 'custom_form', None) is not None and
+                hasattr(tsm.ts, 'set_custom_controls')):
+            try:
+                options = self.controls.custom_form.get()
+                tsm.ts.set_custom_controls(options)
+            except Exception as e:
+                logger.warning(
+                    'Could not use custom controls for timeseries')
+                qgis_log(e.message, level=logging.WARNING)
+                self.controls.custom_form.reset()
+                return False
+        return True
+
+    def _plot_request_setup(self, message):
+        """ Show progress and setup a worker within a new thread
+
+        Args:
+          message (str): message shown next to the progress bar
+
+        """
+        # Setup QProgressBar
+        self.progress_bar = qgis.utils.iface.messageBar().createMessage(
+            message)
+
+        self.progress = QtGui.QProgressBar()
+        self.progress.setValue(0)
+        self.progress.setMaximum(100)
+        self.progress.setAlignment(QtCore.Qt.AlignLeft |
+                                   QtCore.Qt.AlignVCenter)
+
+        self.but_cancel = QtGui.QPushButton('Cancel')
+        self.but_cancel.pressed.connect(self.plot_request_cancel)
+
+        self.progress_bar.layout().addWidget(self.progress)
+        self.progress_bar.layout().addWidget(self.but_cancel)
+
+        qgis.utils.iface.messageBar().pushWidget(
+            self.progress_bar, qgis.utils.iface.messageBar().INFO)
+
+        # Setup worker and thread
+        self.working = True
+        self.streaming = False
+        self.fitting = False
+
+        self.work_thread = QtCore.QThread()
+        # self.worker = Worker()
+        self.worker = Worker(self)
+        self.worker.moveToThread(self.work_thread)
+        self.worker.update.connect(self.plot_request_update)
+        self.worker.streamed.connect(self.plot_request_streamed)
+        self.worker.retrieved.connect(self.plot_request_retrieved)
+        self.worker.finished.connect(self.plot_request_finish)
+        self.worker.errored.connect(self.plot_request_error)
+        self.worker.cancelled.connect(self.plot_request_cancelled)
+        self.worker.fit_started.connect(self.plot_request_fit_start)
+        self.worker.fit_errored.connect(self.plot_request_fit_error)
+
+    @QtCore.pyqtSlot(object, object, tuple, str)
+    def plot_request_start(self, worker, ts, pos, crs_wkt):
+        # Request may have been replaced before its thread started
+        if worker is not self.worker:
+            return
         logger.info('Fetch data signal sent for point: '
                     '{p} ({t})'.format(p=pos, t=type(pos)))
 
         self.fetch_data.emit(ts, pos, crs_wkt)
 
+    @QtCore.pyqtSlot(object, object)
+    def fit_request_start(self, worker, ts):
+        # Request may have been replaced before its thread started
+        if worker is not self.worker:
+            return
+        self.fit_results.emit(ts)
+
     @QtCore.pyqtSlot(float)
     def plot_request_update(self, progress):
-        if self.working is True:
+        if self.working is True and self.sender() is self.worker:
             self.progress.setValue(progress)
 
+    @QtCore.pyqtSlot(int, object)
+    def plot_request_streamed(self, series, images):
+        """ Add data for images just retrieved to the current plot """
+        if self.sender() is not self.worker:
+            return
+        self.streaming = True
+        plot = self.plots[settings.plot_current]
+        if isinstance(plot, plots.TSPlot):
+            plot.plot(series=series, images=images)
+
+    @QtCore.pyqtSlot()
+    def plot_request_retrieved(self):
+        # Ignore requests replaced by a newer request
+        if self.sender() is not self.worker:
+            return
+        logger.info('Plot request data retrieved')
+
+        # Update plots, replacing any data plotted as it was retrieved
+        self.streaming = False
+        self.update_plot()
+
+        # Add geometry from clicked point
+        self.plot_request_geometry()
+
+    @QtCore.pyqtSlot()
+    def plot_request_fit_start(self):
+        if self.sender() is not self.worker:
+            return
+        self.fitting = True
+        self.progress_bar.setText('Fitting model')
+        # No progress reported while fitting
+        self.progress.setMaximum(0)
+
+    @QtCore.pyqtSlot(str)
+    def plot_request_fit_error(self, txt):
+        if self.sender() is not self.worker:
+            return
+        qgis_log('Could not fetch results: %s' % txt, logging.ERROR,
+                 duration=5)
+
     @QtCore.pyqtSlot()
     def plot_request_finish(self):
-        # Get results in this thread since it's so prone to error
-        try:
-            tsm.ts.fetch_results()
-        except Exception as e:
-            logger.error('Could not fetch results: %s' % e.message)
-            raise
-        finally:
-            # Stop 'working'
-            self.working = False
-            self.work_thread.quit()
-
-            # Clear GUI messages
-            logger.info('Plot request finished')
-            qgis.utils.iface.messageBar().clearWidgets()
-
-            # Update plots
+        if self.sender() is not self.worker:
+            return
+        logger.info('Plot request finished')
+        # Overlay results unless the request was cancelled or replaced
+        refresh = self.fitting and not self.worker.cancel_token.cancelled
+
+        # Stop 'working' and clear GUI messages
+        self._plot_request_cleanup()
+
+        if self._pending_request is not None:
+            pos, self._pending_request = self._pending_request, None
+            # Worker is done, so its thread stops right away
+            self.work_thread.wait()
+            self.plot_request(pos)
+        elif refresh:
             self.update_plot()
 
-            # Add geometry from clicked point
-            self.plot_request_geometry()
-
     @QtCore.pyqtSlot(str)
     def plot_request_error(self, txt):
-        qgis.utils.iface.messageBar().clearWidgets()
+        if self.sender() is not self.worker:
+            return
+        self._plot_request_cleanup()
+        self._plot_request_unstream()
         qgis_log(txt, logging.ERROR, duration=5)
 
+    @QtCore.pyqtSlot()
+    def plot_request_cancel(self):
+        """ Cancel the current plot request, keeping the last plotted pixel
+        """
+        self._pending_request = None
+        if self.working:
+            self.worker.cancel_token.cancel()
+
+    @QtCore.pyqtSlot()
+    def plot_request_cancelled(self):
+        if self.sender() is not self.worker:
+            return
+        logger.info('Plot request cancelled')
+        self._plot_request_cleanup()
+        self._plot_request_unstream()
+
+    def plot_request_stop(self):
+        """ Cancel the current plot request and wait for it to stop
+
+        Reads already started are allowed to finish, but no others are
+        started, so the wait is short unless a model is being fit. Signals
+        sent by the stopped request are ignored.
+        """
+        self._pending_request = None
+        if not self.working:
+            return
+        self.worker.cancel_token.cancel()
+        self._plot_request_cleanup()
+        self.work_thread.wait()
+        self._plot_request_unstream()
+
+    def _plot_request_cleanup(self):
+        """ Stop 'working', stop the worker's thread, and clear progress """
         self.working = False
+        self.fitting = False
+        for signal, slot in ((self.fetch_data, self.worker.fetch),
+                             (self.fit_results, self.worker.fit)):
+            try:
+                signal.disconnect(slot)
+            except TypeError:
+                pass
         self.work_thread.quit()
+        qgis.utils.iface.messageBar().clearWidgets()
 
-    @QtCore.pyqtSlot()
-    def plot_request_cancel(self):
-        self.plot_request_finish()
+    def _plot_request_unstream(self):
+        """ Replace any data plotted as it was retrieved with a full plot
+
+        Data streamed by a request that failed or was stopped are partial,
+        so the plot is redrawn from the data the timeseries holds now.
+        """
+        if self.streaming:
+            self.streaming = False
+            self.update_plot()
 
     def plot_request_geometry(self):
         """ Add polygon of geometry from clicked X/Y coordinate """
@@ -687,6 +907,7 @@ class Controller(QtCore.QObject):
 # DISCONNECT
     def disconnect(self):
         logger.info('Disconnecting controller')
+        self.plot_request_stop()
         if not self.initialized:
             return
 
@@ -712,5 +933,6 @@ class Controller(QtCore.QObject):
         self.controls.image_table_row_clicked.disconnect(
             self._add_remove_image)
         self.controls.symbology_applied.disconnect()
+        self.controls.custom_controls_applied.disconnect(self.apply_controls)
 
         self.initialzed = False
@@ -34,6 +34,7 @@ class ControlPanel(QtGui.QWidget, Ui_Controls):
     plot_options_changed = QtCore.pyqtSignal()
     image_table_row_clicked = QtCore.pyqtSignal(int, int)
     symbology_applied = QtCore.pyqtSignal()
+    custom_controls_applied = QtCore.pyqtSignal()
 
     def __init__(self, iface):
         # Qt setup
@@ -518,6 +519,13 @@ class ControlPanel(QtGui.QWidget, Ui_Controls):
         self.custom_form = CustomForm(config)
         self.tab_options.layout().addWidget(self.custom_form)
 
+        # Setup and wire "Apply controls" button to refit current pixel
+        if getattr(tsm.ts, 'has_results', False):
+            self.but_custom_apply = QtGui.QPushButton('Apply controls')
+            self.but_custom_apply.clicked.connect(
+                lambda: self.custom_controls_applied.emit())
+            self.tab_options.layout().addWidget(self.but_custom_apply)
+
 # DISCONNECT SIGNALS
     def disconnect(self):
         """ Disconnect all signals
@@ -561,3 +569,9 @@ class ControlPanel(QtGui.QWidget, Ui_Controls):
             self.custom_form.deleteLater()
             self.tab_options.layout().removeWidget(self.custom_form)
             self.custom_form = None
+        self.but_custom_apply = getattr(self, 'but_custom_apply', None)
+        if self.but_custom_apply:
+            self.but_custom_apply.clicked.disconnect()
+            self.but_custom_apply.deleteLater()
+            self.tab_options.layout().removeWidget(self.but_custom_apply)
+            self.but_custom_apply = None
@@ -30,6 +30,9 @@ class TSPlot(base_plot.BasePlot):
         self.axis_2.xaxis.set_visible(False)
         self.axes.append(self.axis_2)
 
+        # True if data for a pixel are being added as they are retrieved
+        self._streaming = False
+
         # Setup plots
         self.plot()
 
@@ -41,7 +44,7 @@ class TSPlot(base_plot.BasePlot):
         # Nothing to do
         pass
 
-    def _plot_series(self, axis, idx, series, band):
+    def _plot_series(self, axis, idx, series, band, images=None):
         """ Plot a timeseries from a timeseries ts_driver
 
         Args:
@@ -49,6 +52,8 @@ class TSPlot(base_plot.BasePlot):
             idx (int): index of all available plotting bands
             series (int): index of series within timeseries driver
             band (int): index of band within series within timeseries driver
+            images (np.ndarray, optional): only plot data for these images,
+                without any model fit, breaks, or customized plot info
 
         """
         logger.debug('Plotting TS plot series')
@@ -56,6 +61,8 @@ class TSPlot(base_plot.BasePlot):
         for index, marker, color in zip(settings.plot_symbol[idx]['indices'],
                                         settings.plot_symbol[idx]['markers'],
                                         settings.plot_symbol[idx]['colors']):
+            if images is not None:
+                index = index[np.in1d(index, images)]
             # Any points falling into this category?
             if index.size == 0:
                 continue
@@ -69,6 +76,9 @@ class TSPlot(base_plot.BasePlot):
                       ls='',
                       picker=settings.plot['picker_tol'])
 
+        if images is not None:
+            return
+
         if settings.plot['fit']:
             predict = tsm.ts.get_prediction(series, band)
             if predict is not None:
@@ -91,17 +101,45 @@ class TSPlot(base_plot.BasePlot):
                 logger.error('Could not plot TS driver customized plot info: '
                              '%s' % e.message)
 
-    def plot(self):
+    def plot(self, series=None, images=None):
         """ Matplotlib plot of time series
+
+        Args:
+            series (int, optional): index of series within timeseries driver
+                whose data are being retrieved
+            images (np.ndarray, optional): indices of images in `series`
+                just retrieved. If given, only data for these images are
+                added to the plot, which is cleared before the first images
+                of a pixel are added
+
         """
+        if images is not None:
+            if not self._streaming:
+                self._setup_axes('Retrieving data...')
+                self._streaming = True
+            self._plot_bands(series, images)
+            self.fig.canvas.draw_idle()
+            return
+        self._streaming = False
+
         logger.debug('Plotting TS plot')
+        self._setup_axes(tsm.ts.pixel_pos if tsm.ts else None)
+        self._plot_bands()
+
+        # Redraw
+        self.fig.tight_layout()
+        self.fig.canvas.draw()
+        logger.debug('Done plotting TS plot')
+
+    def _setup_axes(self, title=None):
+        """ Clear axes and set title, labels, and limits """
         # Clear before plotting again
         self.axis_1.clear()
         self.axis_2.clear()
 
         # Setup axes
-        if tsm.ts:
-            self.axis_1.set_title(tsm.ts.pixel_pos)
+        if title:
+            self.axis_1.set_title(title)
         self.axis_1.set_xlabel('Date')
         self.axis_1.set_ylabel('Value')  # TODO
 
@@ -120,27 +158,21 @@ class TSPlot(base_plot.BasePlot):
         #                                    self.axis_2.get_ybound()[1], 6))
         self.axis_2.grid('off')
 
-        # Plot -- axis 1
-        added = np.where(settings.plot['y_axis_1_band'])[0]
-        if added.size > 0:
-            for _added in added:
-                _series = settings.plot_series[_added]
-                _band = settings.plot_band_indices[_added]
-
-                self._plot_series(self.axis_1, _added, _series, _band)
-
-        added = np.where(settings.plot['y_axis_2_band'])[0]
-        if added.size > 0:
+    def _plot_bands(self, series=None, images=None):
+        """ Plot bands added to each axis, optionally only for `images` of
+        `series`
+        """
+        for axis, key in ((self.axis_1, 'y_axis_1_band'),
+                          (self.axis_2, 'y_axis_2_band')):
+            added = np.where(settings.plot[key])[0]
             for _added in added:
                 _series = settings.plot_series[_added]
                 _band = settings.plot_band_indices[_added]
+                if images is not None and _series != series:
+                    continue
 
-                self._plot_series(self.axis_2, _added, _series, _band)
-
-        # Redraw
-        self.fig.tight_layout()
-        self.fig.canvas.draw()
-        logger.debug('Done plotting TS plot')
+                self._plot_series(axis, _added, _series, _band,
+                                  images=images)
 
     def disconnect(self):
         pass
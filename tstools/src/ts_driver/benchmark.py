@@ -0,0 +1,309 @@
+""" Benchmark how long timeseries drivers take to open a dataset
+
+Each driver found by `ts_manager` is opened against a synthetic dataset
+(see `synthetic.write_dataset`), or an existing dataset, in a newly started
+Python process so that import costs and peak memory are measured separately
+for each driver. Time spent in each phase of opening the dataset (see
+`ts_utils.profile_phase`) is reported as JSON.
+
+Run from the QGIS plugin directory (or from ``tstools/`` with ``src`` as the
+package name)::
+
+    python -m tstools.ts_driver.benchmark --images 500 --size 250 250
+
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from . import ts_utils
+from .query import find_driver, query
+from .synthetic import write_dataset
+
+logger = logging.getLogger('tstools')
+
+
+def peak_memory():
+    """ Return peak resident memory of this process in kilobytes
+
+    On Linux, the peak is read from "/proc/self/status", which is reset when
+    a new program is executed, since `ru_maxrss` keeps the peak of the
+    process that started it.
+
+    Returns:
+      int: peak resident memory (kB), or None if unavailable
+
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on OS X
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def list_drivers():
+    """ Return names of all timeseries drivers found by `ts_manager`
+
+    Returns:
+      list: class names of drivers
+
+    """
+    from .ts_manager import tsm
+    return [driver.__name__ for driver in tsm.ts_drivers]
+
+
+def driver_config(driver, location):
+    """ Return configuration for a driver to open a synthetic dataset
+
+    Configuration is the driver's default, except for locations of companion
+    datasets that would otherwise be relative to the working directory.
+
+    Args:
+      driver (class): timeseries driver
+      location (str): location of dataset written by
+        `synthetic.write_dataset`
+
+    Returns:
+      list: configuration values for `driver.config`
+
+    """
+    overrides = {
+        '_met_location': os.path.join(location, 'PRISM')
+    }
+    return [overrides.get(attr, getattr(driver, attr))
+            for attr in driver.config]
+
+
+def benchmark_driver(name, location, synthetic=False, fetch=False):
+    """ Open a dataset with a driver and report time spent in each phase
+
+    Args:
+      name (str): class name of driver
+      location (str): location of dataset
+      synthetic (bool): `location` contains a dataset written by
+        `synthetic.write_dataset`
+      fetch (bool): also time a query (see `query.query`) of the center
+        pixel
+
+    Returns:
+      dict: results, including per-phase timings (seconds), peak memory
+        (kB), and the error message if the driver failed
+
+    """
+    ts_utils.phase_timings = {}
+    result = {'driver': name, 'error': None}
+
+    try:
+        with ts_utils.profile_phase('import_drivers'):
+            driver = find_driver(name)
+        result['description'] = driver.description
+
+        config = driver_config(driver, location) if synthetic else None
+        start = time.time()
+        ts = driver(location, config=config)
+        result['open'] = time.time() - start
+        result['n_images'] = sum(len(s.images) for s in ts.series)
+
+        if fetch:
+            series = ts.series[0]
+            gt = series.gt
+            mx = gt[0] + gt[1] * (series.width // 2 + 0.5)
+            my = gt[3] + gt[5] * (series.height // 2 + 0.5)
+
+            start = time.time()
+            query(ts, mx, my, series.crs)
+            result['fetch'] = time.time() - start
+        ts.close()
+    except Exception as e:
+        logger.debug(traceback.format_exc())
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+
+    result['phases'] = ts_utils.phase_timings
+    result['peak_memory_kb'] = peak_memory()
+    ts_utils.phase_timings = None
+
+    return result
+
+
+# Run a function of this module with arguments read from, and its result
+#   written to, JSON files, logging at the level of the benchmark
+_ISOLATED = """\
+import json, logging, sys
+logging.basicConfig(level={level})
+from {module} import {func} as func
+with open(sys.argv[1]) as f:
+    args = json.load(f)
+with open(sys.argv[2], 'w') as f:
+    json.dump(func(*args), f)
+"""
+
+
+def _run_isolated(func, *args):
+    """ Run a function of this module within a new Python process
+
+    Processes are started rather than forked so that the peak memory of the
+    process running `func` does not include memory used by this process.
+
+    Args:
+      func (callable): function defined in this module
+      args: JSON serializable arguments to `func`
+
+    Returns:
+      object: result of `func`, decoded from JSON
+
+    Raises:
+      RuntimeError: raise RuntimeError if the process fails
+
+    """
+    tmpdir = tempfile.mkdtemp(prefix='tstools_benchmark_')
+    args_fn = os.path.join(tmpdir, 'args.json')
+    result_fn = os.path.join(tmpdir, 'result.json')
+    try:
+        with open(args_fn, 'w') as f:
+            json.dump(args, f)
+
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        module = __name__
+        if module == '__main__':
+            module = __package__ + '.benchmark'
+        code = _ISOLATED.format(module=module, func=func.__name__,
+                                level=logger.getEffectiveLevel())
+        ret = subprocess.call([sys.executable, '-c', code, args_fn, result_fn],
+                              env=env)
+        if ret != 0:
+            raise RuntimeError('Could not run %s in a new process (exit '
+                               'code %i)' % (func.__name__, ret))
+
+        with open(result_fn) as f:
+            return json.load(f)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def run(location=None, drivers=None, n_images=100, shape=(100, 100),
+        n_bands=8, fetch=False, **options):
+    """ Benchmark drivers, writing a synthetic dataset if needed
+
+    Args:
+      location (str, optional): dataset to open. If None, a synthetic
+        dataset is written to and removed from a temporary directory
+      drivers (list, optional): class names of drivers to benchmark. If
+        None, all drivers are benchmarked
+      n_images (int): number of synthetic images
+      shape (tuple): number of rows and columns of synthetic images
+      n_bands (int): number of bands of synthetic images
+      fetch (bool): also time a fetch of the center pixel
+      options: additional options for `synthetic.write_dataset` (e.g.,
+        `compress` or `tiled`)
+
+    Returns:
+      dict: benchmark description and list of results for each driver
+
+    """
+    synthetic_location = None
+    if location is None:
+        synthetic_location = tempfile.mkdtemp(prefix='tstools_benchmark_')
+        location = synthetic_location
+
+        start = time.time()
+        write_dataset(location, n_images=n_images, shape=shape,
+                      n_bands=n_bands, **options)
+        logger.info('Wrote synthetic dataset in %.2fs' %
+                    (time.time() - start))
+
+    try:
+        if drivers is None:
+            drivers = _run_isolated(list_drivers)
+
+        results = []
+        for name in drivers:
+            logger.info('Benchmarking %s' % name)
+            results.append(_run_isolated(benchmark_driver, name, location,
+                                         bool(synthetic_location), fetch))
+    finally:
+        if synthetic_location:
+            shutil.rmtree(synthetic_location, ignore_errors=True)
+
+    return {
+        'location': None if synthetic_location else location,
+        'synthetic': {
+            'n_images': n_images,
+            'shape': list(shape),
+            'n_bands': n_bands,
+            'options': options
+        } if synthetic_location else None,
+        'results': results
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark opening datasets with TSTools drivers')
+    parser.add_argument('--location',
+                        help='Benchmark an existing dataset instead of a '
+                             'synthetic dataset')
+    parser.add_argument('--driver', dest='drivers', action='append',
+                        help='Class name of driver to benchmark (repeatable; '
+                             'default: all drivers)')
+    parser.add_argument('--images', type=int, default=100,
+                        help='Number of synthetic images')
+    parser.add_argument('--size', type=int, nargs=2, default=[100, 100],
+                        metavar=('ROWS', 'COLS'),
+                        help='Size of synthetic images')
+    parser.add_argument('--bands', type=int, default=8,
+                        help='Number of bands in synthetic images, including '
+                             'mask band')
+    parser.add_argument('--compress',
+                        help='Compression of synthetic images (e.g., '
+                             'DEFLATE or LZW)')
+    parser.add_argument('--tiled', type=int, nargs=2, metavar=('ROWS', 'COLS'),
+                        help='Write synthetic images tiled with this tile '
+                             'size')
+    parser.add_argument('--fetch', action='store_true',
+                        help='Also time a fetch of the center pixel')
+    parser.add_argument('--output',
+                        help='Write JSON to file (default: stdout)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Show debug messages')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose
+                        else logging.INFO)
+
+    options = {'compress': args.compress}
+    if args.tiled:
+        options.update(tiled=True, block_size=tuple(args.tiled))
+    report = run(location=args.location, drivers=args.drivers,
+                 n_images=args.images, shape=tuple(args.size),
+                 n_bands=args.bands, fetch=args.fetch, **options)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+""" Consolidated on-disk "cube" of all images within a Series
+
+A cube is a directory containing a JSON header and one NumPy ".npy" file for
+each block of rows and columns of the Series. Each block is laid out as
+(row, column, band, time) so that all of the data for one pixel is stored
+contiguously and may be read from a memory map with a single small read.
+
+Cubes are built for every Series of a "Layer Stacked Timeseries (Cube)"
+dataset without QGIS. Run from the QGIS plugin directory (or from
+``tstools/`` with ``src`` as the package name)::
+
+    python -m tstools.ts_driver.cube /data/p012r031
+
+"""
+import argparse
+from collections import OrderedDict
+import json
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger('tstools')
+
+CUBE_HEADER = 'cube.json'
+CUBE_VERSION = 1
+
+
+def name_cube_block(row_block, col_block):
+    """ Return a filename for a block of a cube
+
+    Args:
+      row_block (int): index of block along rows
+      col_block (int): index of block along columns
+
+    Returns:
+      str: block filename
+
+    """
+    return 'r%i_c%i.npy' % (row_block, col_block)
+
+
+def build_cube(series, destination, block_size=(64, 64),
+               max_bytes=256 * 1024 ** 2, cancel=None):
+    """ Convert all images within a Series into a cube
+
+    Blocks are built one row of blocks at a time. Rows of the row of blocks
+    are read from as many images as fit within `max_bytes`, using the Series'
+    pool of open datasets, and written to each block at once, so each block
+    file is written once per group of images instead of once per image. The
+    header is written last so that incomplete cubes are never opened.
+
+    Args:
+      series (Series): Series to convert
+      destination (str): directory to write cube into
+      block_size (tuple): number of rows and columns in each block
+      max_bytes (int): maximum size of images read into memory at once
+      cancel (ts_utils.CancelToken, optional): token checked before each
+        group of images is read
+
+    Yields:
+      float: current progress (0 to 100)
+
+    Raises:
+      ts_utils.FetchCancelled: raise FetchCancelled if `cancel` is
+        cancelled. The cube is left without a header and will not be opened
+
+    """
+    if not os.path.isdir(destination):
+        os.makedirs(destination)
+
+    header_fn = os.path.join(destination, CUBE_HEADER)
+    if os.path.exists(header_fn):
+        os.remove(header_fn)
+
+    nrow, ncol = block_size
+    shape = (series.height, series.width, series.count, series.n)
+    itemsize = np.dtype(series.dtype).itemsize
+    pool = series._ds_pool
+
+    n_row_block = int(np.ceil(series.height / float(nrow)))
+    for i_row_block, yoff in enumerate(range(0, series.height, nrow)):
+        rows = min(nrow, series.height - yoff)
+        n_chunk = int(min(series.n, max(
+            1, max_bytes // (rows * series.width * series.count * itemsize))))
+
+        blocks = []
+        for xoff in range(0, series.width, ncol):
+            cols = min(ncol, series.width - xoff)
+            fn = os.path.join(destination,
+                              name_cube_block(yoff // nrow, xoff // ncol))
+            blocks.append((xoff, cols, np.lib.format.open_memmap(
+                fn, mode='w+', dtype=series.dtype,
+                shape=(rows, cols, series.count, series.n))))
+
+        # Rows read from a group of images, laid out like the blocks
+        chunk = np.empty((rows, series.width, series.count, n_chunk),
+                         dtype=series.dtype)
+        for start in range(0, series.n, n_chunk):
+            if cancel is not None:
+                cancel.check()
+            paths = series.images['path'][start:start + n_chunk]
+            for i, path in enumerate(paths):
+                with pool.dataset(path) as ds:
+                    dat = ds.ReadAsArray(0, yoff, series.width, rows)
+                chunk[..., i] = dat.reshape(
+                    series.count, rows, series.width).transpose(1, 2, 0)
+
+            end = start + len(paths)
+            for xoff, cols, block in blocks:
+                block[..., start:end] = chunk[:, xoff:xoff + cols, :,
+                                              :len(paths)]
+
+            yield ((i_row_block + end / float(series.n)) /
+                   n_row_block * 100.0)
+
+        for _, _, block in blocks:
+            block.flush()
+        del blocks
+
+        logger.debug('Wrote cube row of blocks %i/%i' %
+                     (i_row_block + 1, n_row_block))
+
+    header = {
+        'version': CUBE_VERSION,
+        'shape': shape,
+        'dtype': np.dtype(series.dtype).str,
+        'block_size': [nrow, ncol],
+        'digest': series.image_digest
+    }
+    with open(header_fn, 'w') as f:
+        json.dump(header, f)
+
+
+class Cube(object):
+    """ Read pixels from a cube built by `build_cube`
+
+    Memory maps of the most recently read blocks are kept open.
+
+    Args:
+      location (str): directory containing cube
+      series (Series): Series the cube must describe
+      max_blocks (int): maximum number of block memory maps kept open
+
+    Raises:
+      IOError: raise IOError if the cube header cannot be read
+      IndexError: raise IndexError if the cube does not match the
+        dimensions or images used in `series`
+
+    """
+    def __init__(self, location, series, max_blocks=64):
+        self.location = location
+        self.max_blocks = max_blocks
+
+        with open(os.path.join(location, CUBE_HEADER)) as f:
+            header = json.load(f)
+        if header.get('version') != CUBE_VERSION:
+            raise IndexError('Cube is not in the correct format')
+
+        self.shape = tuple(header['shape'])
+        self.block_size = tuple(header['block_size'])
+        if self.shape != (series.height, series.width,
+                          series.count, series.n):
+            raise IndexError('Cube dimensions do not match series %s' %
+                             series.description)
+        if header['digest'] != series.image_digest:
+            raise IndexError('Cube for series %s does not contain the same '
+                             'image_IDs' % series.description)
+
+        self._blocks = OrderedDict()
+
+    def _block(self, row_block, col_block):
+        key = (row_block, col_block)
+        block = self._blocks.pop(key, None)
+        if block is None:
+            block = np.load(
+                os.path.join(self.location, name_cube_block(*key)),
+                mmap_mode='r')
+            while len(self._blocks) >= max(self.max_blocks, 1):
+                self._blocks.popitem(last=False)
+        self._blocks[key] = block
+        return block
+
+    def read_pixel(self, x, y, out):
+        """ Read all bands and times of a pixel into an existing array
+
+        Args:
+          x (int): column
+          y (int): row
+          out (np.ndarray): 2D array (nband, ntime) to fill
+
+        """
+        nrow, ncol = self.block_size
+        block = self._block(y // nrow, x // ncol)
+        out[:] = block[y % nrow, x % ncol]
+
+    def close(self):
+        """ Close memory maps of any blocks read """
+        self._blocks.clear()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Build cubes for a "Layer Stacked Timeseries (Cube)" '
+                    'dataset')
+    parser.add_argument('location', help='Location of dataset')
+    parser.add_argument('--block-size', type=int, nargs=2,
+                        metavar=('ROWS', 'COLS'),
+                        help="Size of cube blocks (default: driver's)")
+    parser.add_argument('--memory', type=int, default=256,
+                        help='Megabytes of images read into memory at once')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Rebuild cubes that can already be opened')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Show debug messages')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose
+                        else logging.INFO)
+
+    # Imported here since the driver reads from cubes
+    from .timeseries_cube import CubeTimeSeries
+
+    driver = CubeTimeSeries(args.location)
+    if args.block_size:
+        driver._cube_block_size = args.block_size
+    try:
+        for i, series in enumerate(driver.series):
+            if series.cube is not None and not args.rebuild:
+                logger.info('Cube for %s is up to date' % series.description)
+                continue
+            last = 0.0
+            for progress in driver.build_cube(
+                    i, max_bytes=args.memory * 1024 ** 2):
+                if progress - last >= 5:
+                    logger.info('Building cube for %s: %.0f%%' %
+                                (series.description, progress))
+                    last = progress
+            logger.info('Built cube for %s in %s' %
+                        (series.description, series.cube_folder))
+    finally:
+        driver.close()
+
+
+if __name__ == '__main__':
+    main()
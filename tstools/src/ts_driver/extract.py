@@ -0,0 +1,276 @@
+""" Extract timeseries for many points at once without QGIS
+
+Points are read from a CSV or any vector file OGR can open, converted to
+pixel coordinates in each Series with `geo_utils.point2pixel`, and grouped by
+tiles of rows and columns. Within each tile, every block of each image
+that contains points is read once (see `reader.BlockReader`) instead of once
+per point. Tiles should be a multiple of the images' block size.
+
+Output is a "tidy" CSV with one row per point, Series, date, and band::
+
+    point,series,date,band,value,mask
+
+where ``mask`` is 1 if the observation is clear (not masked by the driver's
+mask values) and 0 otherwise.
+
+Run from the QGIS plugin directory (or from ``tstools/`` with ``src`` as the
+package name)::
+
+    python -m tstools.ts_driver.extract StackedTimeSeries /data/p012r031 \\
+        training.shp training_timeseries.csv
+
+"""
+import argparse
+import csv
+import logging
+import os
+
+import numpy as np
+from osgeo import ogr, osr
+
+from .query import open_driver
+from .reader import BlockReader
+from ..utils import geo_utils
+
+logger = logging.getLogger('tstools')
+
+OUTPUT_FIELDS = ['point', 'series', 'date', 'band', 'value', 'mask']
+
+
+def read_points(filename, x_field='x', y_field='y', id_field=None):
+    """ Read IDs and coordinates of points from a CSV or vector file
+
+    Coordinates of features in vector files are taken from the centroid of
+    their geometry.
+
+    Args:
+      filename (str): CSV (``.csv``) or vector file of points
+      x_field (str): CSV column containing X coordinates
+      y_field (str): CSV column containing Y coordinates
+      id_field (str, optional): column or attribute containing point IDs. If
+        None, points are identified by their order in CSV files or by their
+        feature ID in vector files
+
+    Returns:
+      tuple: point IDs, X coordinates, Y coordinates, and the coordinate
+        reference system as Well Known Text, or None if unknown (CSV files)
+
+    """
+    ids, xs, ys = [], [], []
+
+    if os.path.splitext(filename)[1].lower() == '.csv':
+        with open(filename, 'rb') as f:
+            for i, row in enumerate(csv.DictReader(f)):
+                ids.append(row[id_field] if id_field else i)
+                xs.append(float(row[x_field]))
+                ys.append(float(row[y_field]))
+        return ids, np.array(xs), np.array(ys), None
+
+    ds = ogr.Open(filename)
+    if ds is None:
+        raise IOError('Could not open points file %s' % filename)
+    layer = ds.GetLayer()
+    srs = layer.GetSpatialRef()
+    for feature in layer:
+        geom = feature.GetGeometryRef().Centroid()
+        ids.append(feature.GetField(id_field) if id_field
+                   else feature.GetFID())
+        xs.append(geom.GetX())
+        ys.append(geom.GetY())
+    crs_wkt = srs.ExportToWkt() if srs is not None else None
+    ds = None
+
+    return ids, np.array(xs), np.array(ys), crs_wkt
+
+
+def points_to_pixels(series, xs, ys, crs_wkt=None):
+    """ Return pixel coordinates of points within a Series
+
+    Args:
+      series (Series): Series to locate points within
+      xs (np.ndarray): X coordinates of points
+      ys (np.ndarray): Y coordinates of points
+      crs_wkt (str, optional): coordinate reference system of points as Well
+        Known Text, or None if points are in the same system as `series`
+
+    Returns:
+      tuple: column and row (np.ndarray) of each point, and a mask
+        (np.ndarray) of points within the Series
+
+    """
+    px = np.empty(xs.size, dtype=np.int64)
+    py = np.empty(ys.size, dtype=np.int64)
+    for i, (x, y) in enumerate(zip(xs, ys)):
+        if crs_wkt:
+            x, y = geo_utils.reproject_point(x, y, crs_wkt, series.crs)
+        px[i], py[i] = geo_utils.point2pixel(x, y, series.gt)
+
+    inside = ((px >= 0) & (px < series.width) &
+              (py >= 0) & (py < series.height))
+    return px, py, inside
+
+
+def group_pixels(px, py, tile_size=(256, 256)):
+    """ Group pixels by the tile of rows and columns they fall within
+
+    Args:
+      px (np.ndarray): columns of pixels
+      py (np.ndarray): rows of pixels
+      tile_size (tuple): number of rows and columns in each tile
+
+    Yields:
+      np.ndarray: indices of pixels within each tile, ordered by tile row
+        and then tile column
+
+    """
+    tile = np.column_stack((py // tile_size[0], px // tile_size[1]))
+    order = np.lexsort((tile[:, 1], tile[:, 0]))
+    tile = tile[order]
+
+    breaks = np.where(np.any(np.diff(tile, axis=0) != 0, axis=1))[0] + 1
+    for idx in np.split(order, breaks):
+        if idx.size:
+            yield idx
+
+
+def extract_series(series, px, py, tile_size=(256, 256), reader=None):
+    """ Read data for many pixels within a Series
+
+    Pixels are read in groups within a tile (see `group_pixels`), reading
+    each block of each image containing pixels once.
+
+    Args:
+      series (Series): Series to read from
+      px (np.ndarray): columns of pixels
+      py (np.ndarray): rows of pixels
+      tile_size (tuple): number of rows and columns in each tile
+      reader (BlockReader, optional): reader used to read blocks of images
+
+    Yields:
+      tuple: indices of pixels (np.ndarray) read and their data (np.ndarray)
+        of shape (npixel, nband, ntime) in the datatype of the Series
+
+    """
+    reader = reader or BlockReader()
+
+    for idx in group_pixels(px, py, tile_size):
+        _px, _py = px[idx], py[idx]
+
+        data = np.empty((idx.size, series.count, series.n),
+                        dtype=series.dtype)
+        for i_img, path in enumerate(series.images['path']):
+            data[:, :, i_img] = reader.read_pixels(path, _px, _py).T
+
+        yield idx, data
+
+
+def extract(driver, ids, xs, ys, crs_wkt, output, tile_size=(256, 256)):
+    """ Extract timeseries of points from every Series of a driver to a CSV
+
+    Args:
+      driver (AbstractTimeSeriesDriver): timeseries driver to extract from
+      ids (list): point IDs
+      xs (np.ndarray): X coordinates of points
+      ys (np.ndarray): Y coordinates of points
+      crs_wkt (str): coordinate reference system of points as Well Known
+        Text, or None if points are in the same system as the driver's Series
+      output (str): filename of CSV to write
+      tile_size (tuple): number of rows and columns read at once
+
+    Returns:
+      int: number of rows written
+
+    """
+    mask_bands = getattr(driver, '_mask_band', [])
+    n_rows = 0
+
+    with open(output, 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(OUTPUT_FIELDS)
+
+        for i_series, series in enumerate(driver.series):
+            mask_band = (mask_bands[i_series]
+                         if i_series < len(mask_bands) else 0)
+            dates = [d.strftime('%Y-%m-%d') for d in series.images['date']]
+            band_names = list(series.band_names)
+
+            px, py, inside = points_to_pixels(series, xs, ys, crs_wkt)
+            if not inside.all():
+                logger.warning('%i points are outside of %s' %
+                               ((~inside).sum(), series.description))
+            points = np.where(inside)[0]
+
+            reader = BlockReader()
+            for idx, data in extract_series(series, px[points], py[points],
+                                            tile_size=tile_size,
+                                            reader=reader):
+                for i_point, dat in zip(points[idx], data):
+                    if mask_band:
+                        clear = np.in1d(dat[mask_band - 1],
+                                        driver.mask_values, invert=True)
+                    else:
+                        clear = np.ones(series.n, dtype=np.bool)
+                    if series.data_transform is not None:
+                        dat = series.data_transform(dat)
+
+                    for i_band, band_name in enumerate(band_names):
+                        writer.writerows(
+                            (ids[i_point], series.description, date,
+                             band_name, value, int(_clear))
+                            for date, value, _clear in zip(
+                                dates, dat[i_band], clear))
+                    n_rows += series.n * len(band_names)
+            reader.close()
+
+            logger.info('Extracted %i points from %s' %
+                        (points.size, series.description))
+
+    return n_rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Extract timeseries of many points with TSTools drivers')
+    parser.add_argument('driver',
+                        help='Class name or description of driver')
+    parser.add_argument('location', help='Location of dataset')
+    parser.add_argument('points', help='CSV or vector file of points')
+    parser.add_argument('output', help='CSV file to write')
+    parser.add_argument('--x-field', default='x',
+                        help='CSV column of X coordinates')
+    parser.add_argument('--y-field', default='y',
+                        help='CSV column of Y coordinates')
+    parser.add_argument('--id-field',
+                        help='Column or attribute of point IDs')
+    parser.add_argument('--epsg', type=int,
+                        help='EPSG code of CSV coordinates (default: same '
+                             'as dataset)')
+    parser.add_argument('--tile', type=int, nargs=2, default=[256, 256],
+                        metavar=('ROWS', 'COLS'),
+                        help='Size of tiles of pixels read at once')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Show debug messages')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose
+                        else logging.INFO)
+
+    ids, xs, ys, crs_wkt = read_points(args.points, x_field=args.x_field,
+                                       y_field=args.y_field,
+                                       id_field=args.id_field)
+    if args.epsg:
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(args.epsg)
+        crs_wkt = srs.ExportToWkt()
+
+    driver = open_driver(args.driver, args.location)
+    try:
+        n = extract(driver, ids, xs, ys, crs_wkt, args.output,
+                    tile_size=tuple(args.tile))
+    finally:
+        driver.close()
+    logger.info('Wrote %i rows to %s' % (n, args.output))
+
+
+if __name__ == '__main__':
+    main()
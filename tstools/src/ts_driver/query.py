@@ -0,0 +1,111 @@
+""" Query timeseries drivers for a pixel without QGIS or Qt
+
+The plugin retrieves data through `Controller.plot_request`, which runs
+`fetch_data` and then `fetch_results` in a `QThread`. `query` performs the
+same steps in the calling thread so drivers may be used from scripts, batch
+extraction, and benchmarks on machines without QGIS.
+
+Example:
+    >>> from tstools.ts_driver.query import open_driver, query
+    >>> ts = open_driver('YATSMTimeSeries', '/data/p012r031')
+    >>> result = query(ts, 324915.0, 4734315.0, ts.series[0].crs)
+    >>> result['series'][0]['data'].shape
+    (8, 431)
+
+"""
+
+
+def find_driver(name):
+    """ Return a timeseries driver class by class name or description
+
+    Args:
+      name (str): class name (e.g., 'StackedTimeSeries') or description
+        (e.g., 'Layer Stacked Timeseries') of driver
+
+    Returns:
+      class: timeseries driver
+
+    Raises:
+      KeyError: raise KeyError if no driver matches `name`
+
+    """
+    from .ts_manager import tsm
+    for driver in tsm.ts_drivers:
+        if name in (driver.__name__, driver.description):
+            return driver
+    raise KeyError('Cannot find timeseries driver "%s"' % name)
+
+
+def open_driver(name, location, config=None):
+    """ Open a dataset with a timeseries driver
+
+    Args:
+      name (str): class name or description of driver
+      location (str): location of dataset
+      config (list, optional): configuration values for the driver's
+        `config` attributes, or None for the driver's defaults
+
+    Returns:
+      AbstractTimeSeriesDriver: timeseries driver opened for `location`
+
+    """
+    return find_driver(name)(location, config=config)
+
+
+def query(driver, x, y, crs_wkt, results=True, callback=None, cancel=None):
+    """ Retrieve data, mask, predictions, and breaks for a pixel
+
+    Args:
+      driver (AbstractTimeSeriesDriver): timeseries driver to query
+      x (float): map X location
+      y (float): map Y location
+      crs_wkt (str): Well Known Text (Wkt) Coordinate reference system
+        string describing (x, y)
+      results (bool): read or calculate model results (predictions and
+        breaks) if the driver has them
+      callback (callable, optional): function called with the retrieval
+        progress (0 to 100)
+      cancel (ts_utils.CancelToken, optional): token used to cancel the
+        query from another thread
+
+    Returns:
+      dict: 'pixel_pos' describing the pixel queried and a list 'series'
+        containing, for each Series, a dict with its 'description',
+        'images', 'band_names', 'data' (nband, ntime), 'mask' (ntime), and
+        per band lists of 'predictions' and 'breaks' (each None, or a tuple
+        of x and y as returned by the driver)
+
+    Raises:
+      IndexError: raise IndexError if map coordinates are outside of
+        dataset
+      ts_utils.FetchCancelled: raise FetchCancelled if `cancel` is
+        cancelled
+
+    """
+    for progress in driver.fetch_data(x, y, crs_wkt, cancel=cancel):
+        if callback is not None:
+            callback(progress)
+
+    results = results and driver.has_results
+    if results:
+        driver.fetch_results()
+
+    out = []
+    for i, series in enumerate(driver.series):
+        bands = range(series.count)
+        out.append({
+            'description': series.description,
+            'images': series.images,
+            'band_names': list(series.band_names),
+            'data': series.get_values(),
+            'mask': series.mask.copy(),
+            'predictions': [driver.get_prediction(i, b) if results else None
+                            for b in bands],
+            'breaks': [driver.get_breaks(i, b) if results else None
+                       for b in bands]
+        })
+
+    return {
+        'pixel_pos': driver.pixel_pos,
+        'series': out
+    }
@@ -1,34 +1,416 @@
 """ Functions and classes useful for reading remote sensing imagery in GDAL
 """
+from collections import OrderedDict
+from contextlib import contextmanager
+import ctypes
 import logging
+import multiprocessing
+import threading
 
 import numpy as np
 from osgeo import gdal, gdal_array
 
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
 logger = logging.getLogger('tstools')
 
 gdal.AllRegister()
 gdal.UseExceptions()
 
 
-def read_pixel_GDAL(filename, x, y):
+def default_pool_size():
+    """ Return how many idle GDAL datasets one process may keep open
+
+    One quarter of the limit on open files of the process is used, leaving
+    the rest for GDAL (e.g., sources of VRT datasets), QGIS, and other files.
+
+    Returns:
+      int: maximum number of idle open datasets
+
+    """
+    if resource is None:
+        return 64
+    try:
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    except (ValueError, resource.error):
+        return 64
+    if soft == resource.RLIM_INFINITY:
+        return 256
+    return min(max(soft // 4, 8), 256)
+
+
+class DatasetPool(object):
+    """ A bounded, least recently used pool of open GDAL datasets
+
+    GDAL dataset handles are not safe to share between threads, so each
+    dataset is checked out by one thread at a time (see `dataset`) and
+    returned to the pool once the thread is done reading. Idle datasets are
+    reused by any thread, including threads started for later requests. At
+    most `maxsize` idle datasets are kept open; the least recently used
+    dataset is closed when another is returned.
+
+    Args:
+      maxsize (int, optional): maximum number of idle open datasets. If
+        None, the size is chosen from the limit on open files of the process
+        (see `default_pool_size`)
+
+    """
+    def __init__(self, maxsize=None):
+        if maxsize is None:
+            maxsize = default_pool_size()
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._idle = OrderedDict()
+        self._n_idle = 0
+
+    @contextmanager
+    def dataset(self, filename):
+        """ Check out an open dataset for `filename`, opening it if needed
+
+        Args:
+          filename (str): filename to open
+
+        Yields:
+          gdal.Dataset: dataset opened read only, used only by the calling
+            thread until returned to the pool
+
+        """
+        ds = None
+        with self._lock:
+            idle = self._idle.get(filename)
+            if idle:
+                ds = idle.pop()
+                if not idle:
+                    del self._idle[filename]
+                self._n_idle -= 1
+        if ds is None:
+            ds = gdal.Open(filename, gdal.GA_ReadOnly)
+
+        try:
+            yield ds
+        finally:
+            self._release(filename, ds)
+
+    def _release(self, filename, ds):
+        with self._lock:
+            idle = self._idle.pop(filename, [])
+            idle.append(ds)
+            self._idle[filename] = idle
+            self._n_idle += 1
+            while self._n_idle > max(self.maxsize, 1):
+                oldest = next(iter(self._idle))
+                self._idle[oldest].pop(0)
+                if not self._idle[oldest]:
+                    del self._idle[oldest]
+                self._n_idle -= 1
+
+    def close(self, filenames=None):
+        """ Close idle datasets
+
+        Args:
+          filenames (iterable, optional): close only idle datasets of these
+            files instead of all idle datasets
+
+        """
+        with self._lock:
+            if filenames is None:
+                self._idle.clear()
+                self._n_idle = 0
+                return
+            for filename in filenames:
+                self._n_idle -= len(self._idle.pop(filename, []))
+
+
+# Pool of open datasets shared by every Series within this process, so that
+#   drivers with many Series stay within the limit on open files
+shared_pool = DatasetPool()
+
+
+@contextmanager
+def _open(filename, pool=None):
+    if pool is not None:
+        with pool.dataset(filename) as ds:
+            yield ds
+    else:
+        yield gdal.Open(filename, gdal.GA_ReadOnly)
+
+
+def read_pixel_GDAL(filename, x, y, pool=None):
     """ Reads in a pixel of data from an images using GDAL
 
     Args:
       filename (str): filename to read from
       x (int): column
       y (int): row
+      pool (DatasetPool, optional): pool of open datasets to read from
+        instead of opening `filename` for each read
 
     Returns:
       np.ndarray: 1D array (nband) containing the pixel data
 
     """
-    ds = gdal.Open(filename, gdal.GA_ReadOnly)
-    dtype = gdal_array.GDALTypeCodeToNumericTypeCode(
-        ds.GetRasterBand(1).DataType)
+    with _open(filename, pool) as ds:
+        dtype = gdal_array.GDALTypeCodeToNumericTypeCode(
+            ds.GetRasterBand(1).DataType)
 
-    dat = np.empty(ds.RasterCount, dtype=dtype)
-    for i in range(ds.RasterCount):
-        dat[i] = ds.GetRasterBand(i + 1).ReadAsArray(x, y, 1, 1)
+        dat = np.empty(ds.RasterCount, dtype=dtype)
+        _read_pixel(ds, x, y, dat)
 
     return dat
+
+
+def read_pixel_GDAL_into(filename, x, y, out, pool=None):
+    """ Reads in a pixel of data from an image into an existing array
+
+    All bands are read with one request to GDAL, which converts the data
+    to the datatype of `out`.
+
+    Args:
+      filename (str): filename to read from
+      x (int): column
+      y (int): row
+      out (np.ndarray): 1D array (nband) to fill with the pixel data, such
+        as a column of `Series._scratch_data`
+      pool (DatasetPool, optional): pool of open datasets to read from
+        instead of opening `filename` for each read
+
+    """
+    with _open(filename, pool) as ds:
+        _read_pixel(ds, x, y, out)
+
+
+def _read_pixel(ds, x, y, out):
+    buf_type = gdal_array.NumericTypeCodeToGDALTypeCode(out.dtype.type)
+    buf = ds.ReadRaster(x, y, 1, 1,
+                        buf_type=buf_type,
+                        band_list=list(range(1, ds.RasterCount + 1)))
+    out[:] = np.frombuffer(buf, dtype=out.dtype)
+
+
+class BlockReader(object):
+    """ Read pixels by the native blocks of images, caching recent blocks
+
+    Compressed or tiled images are decompressed one block at a time, so
+    reading one pixel costs as much as reading its whole block. Reading the
+    block once and keeping it lets every other pixel requested from the block
+    be served from memory. Blocks are kept in a least recently used cache
+    bounded by size that may be shared by many threads.
+
+    Args:
+      max_bytes (int): maximum size of cached blocks in bytes
+      pool (DatasetPool, optional): pool of open datasets to read blocks
+        from
+
+    Attributes:
+      hits (int): number of pixel reads served from cached blocks
+      misses (int): number of blocks read
+      nbytes (int): current size of cached blocks
+
+    """
+    def __init__(self, max_bytes=128 * 1024 ** 2, pool=None):
+        self.max_bytes = max_bytes
+        self.pool = pool or DatasetPool()
+        self.hits, self.misses, self.nbytes = 0, 0, 0
+        self._blocks = OrderedDict()
+        self._layouts = {}
+        self._lock = threading.Lock()
+
+    def _layout(self, filename):
+        layout = self._layouts.get(filename)
+        if layout is None:
+            with self.pool.dataset(filename) as ds:
+                bxsize, bysize = ds.GetRasterBand(1).GetBlockSize()
+                layout = (bysize, bxsize, ds.RasterYSize, ds.RasterXSize,
+                          ds.RasterCount)
+            self._layouts[filename] = layout
+        return layout
+
+    def block(self, filename, x, y):
+        """ Return the block of an image containing a pixel
+
+        Args:
+          filename (str): filename to read from
+          x (int): column
+          y (int): row
+
+        Returns:
+          tuple: 3D array (nband, nrow, ncol) of the block, and the column
+            and row of its upper left pixel
+
+        """
+        bysize, bxsize, height, width, count = self._layout(filename)
+        xoff, yoff = x // bxsize * bxsize, y // bysize * bysize
+        key = (filename, yoff, xoff)
+
+        with self._lock:
+            block = self._blocks.pop(key, None)
+            if block is not None:
+                self._blocks[key] = block
+                self.hits += 1
+                return block, xoff, yoff
+
+        ncol, nrow = min(bxsize, width - xoff), min(bysize, height - yoff)
+        with self.pool.dataset(filename) as ds:
+            block = ds.ReadAsArray(xoff, yoff, ncol, nrow)
+        block = block.reshape(count, nrow, ncol)
+
+        with self._lock:
+            self.misses += 1
+            if key not in self._blocks:
+                self._blocks[key] = block
+                self.nbytes += block.nbytes
+            while self.nbytes > self.max_bytes and len(self._blocks) > 1:
+                _, old = self._blocks.popitem(last=False)
+                self.nbytes -= old.nbytes
+
+        return block, xoff, yoff
+
+    def read_pixel(self, filename, x, y, out):
+        """ Read all bands of a pixel into an existing array
+
+        Args:
+          filename (str): filename to read from
+          x (int): column
+          y (int): row
+          out (np.ndarray): 1D array (nband) to fill with the pixel data
+
+        """
+        block, xoff, yoff = self.block(filename, x, y)
+        out[:] = block[:, y - yoff, x - xoff]
+
+    def read_pixels(self, filename, x, y):
+        """ Read all bands of many pixels, reading each block once
+
+        Args:
+          filename (str): filename to read from
+          x (np.ndarray): columns
+          y (np.ndarray): rows
+
+        Returns:
+          np.ndarray: 2D array (nband, npixel) of pixel data
+
+        """
+        bysize, bxsize, _, _, count = self._layout(filename)
+        if x.size == 0:
+            return np.empty((count, 0))
+        keys = (y // bysize) * (x.max() // bxsize + 1) + x // bxsize
+
+        out = None
+        for key in np.unique(keys):
+            idx = np.where(keys == key)[0]
+            block, xoff, yoff = self.block(filename, x[idx[0]], y[idx[0]])
+            if out is None:
+                out = np.empty((count, x.size), dtype=block.dtype)
+            out[:, idx] = block[:, y[idx] - yoff, x[idx] - xoff]
+
+        return out
+
+    def clear(self):
+        """ Remove all cached blocks """
+        with self._lock:
+            self._blocks.clear()
+            self.nbytes = 0
+
+    def close(self):
+        """ Remove all cached blocks and close open datasets """
+        self.clear()
+        self._layouts = {}
+        self.pool.close()
+
+
+# Per-process state for `ProcessReader` worker processes
+_worker_pool = None
+_worker_data = None
+_worker_cancel = None
+
+
+def _init_worker(buf, shape, dtype, pool_size, cancel):
+    global _worker_pool, _worker_data, _worker_cancel
+    _worker_pool = DatasetPool(pool_size)
+    _worker_data = np.frombuffer(buf, dtype=dtype).reshape(shape)
+    _worker_cancel = cancel
+
+
+def _worker_read(args):
+    i_img, filename, x, y = args
+    if _worker_cancel.is_set():
+        return None
+    read_pixel_GDAL_into(filename, x, y, _worker_data[:, i_img],
+                         pool=_worker_pool)
+    return i_img
+
+
+class ProcessReader(object):
+    """ Read pixels from many images using a pool of processes
+
+    Useful for compressed images where decompression, rather than I/O, limits
+    how quickly data can be read. Each worker process keeps its own
+    `DatasetPool` and writes the pixel values it reads into a block of shared
+    memory with one column per image, so only image indices are sent back to
+    the parent process.
+
+    Note:
+      On Windows, `multiprocessing.set_executable` may need to point to a
+      Python interpreter since QGIS embeds Python.
+
+    Args:
+      shape (tuple): shape of data to read (nband, nimage)
+      dtype (np.dtype): datatype of data to read
+      workers (int): number of worker processes
+      pool_size (int, optional): maximum number of GDAL datasets kept open
+        per worker. If None, the size is chosen from the limit on open files
+        of each worker (see `default_pool_size`)
+
+    Attributes:
+      data (np.ndarray): view of the shared memory containing data read
+
+    """
+    def __init__(self, shape, dtype, workers, pool_size=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.workers = workers
+
+        nbytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self._buf = multiprocessing.RawArray(ctypes.c_char, nbytes)
+        self.data = np.frombuffer(self._buf,
+                                  dtype=self.dtype).reshape(self.shape)
+        self._cancel = multiprocessing.Event()
+        self._pool = multiprocessing.Pool(
+            workers,
+            initializer=_init_worker,
+            initargs=(self._buf, self.shape, self.dtype.str, pool_size,
+                      self._cancel))
+
+    def read(self, filenames, x, y, cancel=None):
+        """ Read a pixel from each image into `data`
+
+        Args:
+          filenames (iterable): filenames to read from, one per column of
+            `data`
+          x (int): column
+          y (int): row
+          cancel (ts_utils.CancelToken, optional): token checked as images
+            are read. Once cancelled, worker processes skip images not yet
+            read and no more indices are yielded
+
+        Yields:
+          int: index of image read, in order of completion
+
+        """
+        self._cancel.clear()
+        tasks = [(i, fname, x, y) for i, fname in enumerate(filenames)]
+        chunksize = max(1, len(tasks) // (self.workers * 4))
+        for i_img in self._pool.imap_unordered(_worker_read, tasks,
+                                               chunksize=chunksize):
+            if cancel is not None and cancel.cancelled:
+                self._cancel.set()
+            elif i_img is not None:
+                yield i_img
+
+    def close(self):
+        """ Terminate worker processes """
+        self._pool.terminate()
+        self._pool.join()
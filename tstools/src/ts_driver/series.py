@@ -1,18 +1,32 @@
 """ Module for Series dataset container classes
 """
 from datetime import datetime as dt
+from functools import partial
 import logging
+from multiprocessing.pool import ThreadPool
 import os
+import threading
+import time
 
 import numpy as np
 from osgeo import gdal, gdal_array
 
 from . import ts_utils
-from .reader import read_pixel_GDAL
+from .cube import Cube
+from .reader import (BlockReader, DatasetPool, ProcessReader,
+                     read_pixel_GDAL_into, shared_pool)
 from ..utils import geo_utils
 
 logger = logging.getLogger('tstools')
 
+# Ordinal of the NumPy datetime64 epoch (1970-01-01)
+_ORDINAL_EPOCH = dt(1970, 1, 1).toordinal()
+
+# Series attributes read from an image, and allocated using them, on first use
+_PROBED_ATTRIBUTES = ('band_names', 'width', 'height', 'count', 'dtype',
+                      'gt', 'crs')
+_DATA_ATTRIBUTES = ('data', '_scratch_data')
+
 
 class Series(object):
     """ A container class for timeseries driven by a TimeSeries driver
@@ -20,6 +34,8 @@ class Series(object):
     Note:
       You can set class attributes using an optionally supplied configuration
         dictionary when instantiating the class.
+      Attributes describing the images (e.g., `band_names`, `width`, `crs`)
+        are read with GDAL when first used.
 
     Args:
       filenames (list): filenames for images to be included in the Series
@@ -34,6 +50,10 @@ class Series(object):
         "filename" (str), "path" (str), "id" (str), "date" (dt.Date), and
         "ordinal" (int).
       band_names (iterable): list of names describing each band
+      data (np.ndarray): 2D array (nband, ntime) of data for the current pixel
+        stored in the native datatype of the images (`dtype`)
+      data_transform (callable): optional function converting `data` into
+        floating point values (e.g., rescaling DNs) used by `get_values`
 
       symbology_hint_indices (tuple): three band indices (RGB) used for default
         symbology
@@ -50,11 +70,37 @@ class Series(object):
 
       cache_prefix (str): cache filename prefix
       cache_suffix (str): cache filename suffix
+      image_digest (str): digest of image IDs used to name and validate
+        cache files
+
+      pool_size (int): maximum number of idle GDAL datasets kept open for
+        reuse by later reads. If None, datasets are kept in a pool shared by
+        every Series in the process (`reader.shared_pool`) and sized from
+        the limit on open files
+      read_mode (str): how images are read when more than one worker is
+        requested: "thread" for a pool of threads or "process" for a pool of
+        processes. "serial" always reads one image at a time. "block" reads
+        and caches the native block of each image containing the pixel so
+        nearby pixels are read from memory (using a pool of threads if more
+        than one worker is requested)
+      read_workers (int): number of threads or processes used to read images
+        concurrently (1 reads serially)
+      block_cache_size (int): maximum size in bytes of blocks cached when
+        `read_mode` is "block"
+      memory_cache (bool): keep data fetched in an in memory cache
+        (`ts_utils.pixel_cache`) checked before cache files or images
+      stream_interval (float): when data are streamed (see `fetch_data`),
+        seconds between publishing images read
+      stream_images (int): when data are streamed, also publish once this
+        many images have been read since last published (0 to disable)
 
     Methods:
       fetch_data: read data for a given X/Y, yielding progress as percentage
+      get_values: return data as floating point values
+      cache_lines: read rows of data from every image and save to line cache
       get_geometry: return Well Known Text (Wkt) of geometry and projection
         of query specified by X/Y coordinate
+      close: close any open GDAL datasets
 
     """
     description = 'Stacked TimeSeries'
@@ -65,7 +111,6 @@ class Series(object):
                              ('date', object),
                              ('ordinal', 'u4'),
                              ('doy', 'u2')])
-    band_names = []
 
     # Basic symbology hints by default
     symbology_hint_indices = [3, 2, 1]
@@ -81,21 +126,42 @@ class Series(object):
     cache_prefix = ''
     cache_suffix = ''
 
+    data_transform = None
+
+    pool_size = None
+    read_mode = 'thread'
+    read_workers = 1
+    block_cache_size = 256 * 1024 ** 2
+    memory_cache = True
+    stream_interval = 0.25
+    stream_images = 0
+
     px, py = 0, 0
 
     def __init__(self, filenames, date_index=(9, 16), date_format='%Y%j',
                  config=None):
         self._init_images(filenames, date_index, date_format)
-        self.data = np.zeros((self.count, self.n), dtype=np.float)
-        self._scratch_data = np.zeros_like(self.data)
+        self.image_digest = ts_utils.digest_image_IDs(self.images['id'])
+        self._values = None
+        self._values_lock = threading.Lock()
         self.mask = np.ones(self.n, dtype=np.bool)
 
         if config:
             self.__dict__.update(config)
 
+        if self.pool_size is None:
+            self._ds_pool = shared_pool
+        else:
+            self._ds_pool = DatasetPool(self.pool_size)
+        self._read_pool = None
+        self._process_reader = None
+        self._block_reader = None
+        self._images_key = hash(tuple(self.images['path']))
+
     def fetch_data(self, mx, my, crs_wkt,
                    cache_folder='',
-                   read_cache=False, write_cache=False):
+                   read_cache=False, write_cache=False, cancel=None,
+                   publish=None):
         """ Read data for a given x, y coordinate in a given CRS
 
         Args:
@@ -106,6 +172,14 @@ class Series(object):
           cache_folder (str): path to cache folder
           read_cache (bool): allow reading from cache
           write_cache (bool): allow writing to cache
+          cancel (ts_utils.CancelToken, optional): token checked between
+            image reads. If cancelled, reads not yet started are skipped and
+            data for the previous pixel are kept
+          publish (callable, optional): stream data read from images by
+            copying them into `data` in batches (see `stream_interval` and
+            `stream_images`) and calling `publish` with the indices of
+            images in each batch. `data` for images not yet published are
+            from the previous pixel
 
         Yields:
           float: current retrieval progress (1 to n)
@@ -113,10 +187,14 @@ class Series(object):
         Raises:
           IndexError: raise IndexError if map coordinates are outside of
             dataset
+          ts_utils.FetchCancelled: raise FetchCancelled if `cancel` is
+            cancelled before all images are read
 
         """
+        last_px, last_py = self.px, self.py
         mx, my = geo_utils.reproject_point(mx, my, crs_wkt, self.crs)
         self.px, self.py = geo_utils.point2pixel(mx, my, self.gt)
+        self._values = None
 
         if (self.px < 0 or self.py < 0 or
                 self.px > self.width or self.py > self.height):
@@ -124,20 +202,32 @@ class Series(object):
                              '%i/%i' % (self.px, self.py))
 
         got_cache = False
-        pixel = ts_utils.name_cache_pixel(self.px, self.py,
-                                          self.data.shape,
+        pixel = ts_utils.name_cache_pixel(self.data.shape,
                                           prefix=self.cache_prefix,
-                                          suffix=self.cache_suffix)
+                                          suffix=self.cache_suffix,
+                                          digest=self.image_digest)
         pixel_fn = os.path.join(cache_folder, pixel)
 
         line = ts_utils.name_cache_line(self.py,
                                         self.data.shape,
                                         prefix=self.cache_prefix,
-                                        suffix=self.cache_suffix)
+                                        suffix=self.cache_suffix,
+                                        digest=self.image_digest)
         line_fn = os.path.join(cache_folder, line)
 
         i = 0
-        # First try pixel cache
+        # First try memory
+        memory_key = (self.description, self.px, self.py, self._images_key)
+        if self.memory_cache:
+            dat = ts_utils.pixel_cache.get(memory_key)
+            if dat is not None:
+                logger.debug('Read pixel from memory')
+                self.data = dat
+                i += self.data.shape[1]
+                yield float(i)
+                return
+
+        # Then try pixel cache
         if read_cache and os.path.isfile(pixel_fn):
             logger.debug('Trying to read pixel from cache')
             try:
@@ -146,11 +236,12 @@ class Series(object):
                 logger.warning('Could not read from cache file %s: %s' %
                                (pixel_fn, e.message))
             else:
-                logger.debug('Read pixel from cache')
-                self.data = dat
-                got_cache = True
-                i += self.data.shape[1]
-                yield float(i)
+                if dat is not None:
+                    logger.debug('Read pixel from cache')
+                    self.data = dat
+                    got_cache = True
+                    i += self.data.shape[1]
+                    yield float(i)
 
         # If pixel cache fails, try line
         if read_cache and os.path.isfile(line_fn) and not got_cache:
@@ -162,21 +253,47 @@ class Series(object):
                                (line_fn, e.message))
             else:
                 logger.debug('Read line from cache')
-                self.data = dat[..., self.px]
+                self.data = np.array(dat[self.px])
                 got_cache = True
                 i += self.data.shape[1]
                 yield float(i)
 
         # Last resort -- read from images
         if not got_cache:
-            for i_img in range(self.n):
-                self._scratch_data[:, i_img] = read_pixel_GDAL(
-                    self.images['path'][i_img], self.px, self.py)
-                i += 1
-                yield float(i)
-
-                # Copy from scratch variable if it completes
+            previous, batch = None, []
+            last_publish = time.time()
+            try:
+                for i_img in self._image_reader(cancel):
+                    i += 1
+                    if publish is not None:
+                        batch.append(i_img)
+                        if self._stream_ready(len(batch), last_publish):
+                            if previous is None:
+                                previous = self.data.copy()
+                            self._publish(batch)
+                            publish(np.array(batch))
+                            batch, last_publish = [], time.time()
+                    yield float(i)
+                if cancel is not None:
+                    cancel.check()
+            except ts_utils.FetchCancelled:
+                logger.debug('Cancelled reading pixel from images')
+                self.px, self.py = last_px, last_py
+                if previous is not None:
+                    with self._values_lock:
+                        np.copyto(self.data, previous)
+                        self._values = None
+                raise
+
+            # Copy from scratch variable if it completes
+            with self._values_lock:
                 np.copyto(self.data, self._scratch_data)
+                self._values = None
+            if batch:
+                publish(np.array(batch))
+
+        if self.memory_cache:
+            ts_utils.pixel_cache.put(memory_key, self.data)
 
         if write_cache and not got_cache:
             try:
@@ -185,6 +302,88 @@ class Series(object):
                 logger.warning('Could not cache pixel to %s: %s' %
                                (pixel_fn, e.message))
 
+    def get_values(self):
+        """ Return data for the current pixel as floating point values
+
+        Data are converted, using `data_transform` if provided, once per
+        pixel fetched.
+
+        Returns:
+          np.ndarray: 2D array (nband, ntime) of floating point data
+
+        """
+        with self._values_lock:
+            if self._values is None:
+                if self.data_transform is not None:
+                    self._values = self.data_transform(self.data)
+                else:
+                    self._values = self.data.astype(np.float)
+            return self._values
+
+    def cache_lines(self, y, nrow, cache_folder, stop=None):
+        """ Read rows of data from every image and save to line cache files
+
+        Rows that are already cached are skipped. Remaining rows are read
+        with one windowed read per image.
+
+        Args:
+          y (int): first row to cache
+          nrow (int): number of rows to cache
+          cache_folder (str): path to cache folder
+          stop (threading.Event, optional): event that, once set, stops the
+            caching before the next image is read
+
+        Returns:
+          list: rows cached
+
+        """
+        filenames = {}
+        for row in range(max(y, 0), min(y + nrow, self.height)):
+            fn = os.path.join(cache_folder,
+                              ts_utils.name_cache_line(
+                                  row, self.data.shape,
+                                  prefix=self.cache_prefix,
+                                  suffix=self.cache_suffix,
+                                  digest=self.image_digest))
+            if not os.path.isfile(fn):
+                filenames[row] = fn
+        if not filenames:
+            return []
+
+        ystart, yend = min(filenames), max(filenames) + 1
+        lines = {}
+        for row, fn in filenames.items():
+            lines[row] = np.lib.format.open_memmap(
+                fn + '.tmp', mode='w+', dtype=self.dtype,
+                shape=(self.width, self.count, self.n))
+
+        try:
+            for i_img, path in enumerate(self.images['path']):
+                if stop is not None and stop.is_set():
+                    logger.debug('Stopped caching lines %i-%i' %
+                                 (ystart, yend - 1))
+                    return []
+                # Not pooled since this may run in a short-lived thread
+                ds = gdal.Open(path, gdal.GA_ReadOnly)
+                dat = ds.ReadAsArray(0, ystart, self.width, yend - ystart)
+                dat = dat.reshape(self.count, yend - ystart, self.width)
+                for row, line in lines.items():
+                    line[:, :, i_img] = dat[:, row - ystart, :].T
+
+            for row in sorted(lines):
+                lines[row].flush()
+                lines[row] = None
+                ts_utils.write_cache_line_header(filenames[row], self)
+                os.rename(filenames[row] + '.tmp', filenames[row])
+        finally:
+            for row in lines:
+                lines[row] = None
+                if os.path.exists(filenames[row] + '.tmp'):
+                    os.remove(filenames[row] + '.tmp')
+
+        logger.debug('Cached lines %i-%i' % (ystart, yend - 1))
+        return sorted(filenames)
+
     def get_geometry(self):
         """ Return geometry and projection for data queried
 
@@ -197,6 +396,146 @@ class Series(object):
 
         return geom.ExportToWkt(), self.crs
 
+    def close(self):
+        """ Close any GDAL datasets and threads held open for reading """
+        if self._read_pool is not None:
+            self._read_pool.terminate()
+            self._read_pool = None
+        if self._process_reader is not None:
+            self._process_reader.close()
+            self._process_reader = None
+        if self._block_reader is not None:
+            self._block_reader.clear()
+            self._block_reader = None
+        if self._ds_pool is shared_pool:
+            self._ds_pool.close(self.images['path'])
+        else:
+            self._ds_pool.close()
+
+    def restore(self, data, px, py):
+        """ Restore data and position of a pixel fetched previously
+
+        Args:
+          data (np.ndarray): 2D array (nband, ntime) of data for the pixel
+          px (int): column of the pixel
+          py (int): row of the pixel
+
+        """
+        with self._values_lock:
+            self.data = data
+            self._values = None
+        self.px, self.py = px, py
+
+    def _stream_ready(self, n, last_publish):
+        """ Return True if a batch of `n` images should be published """
+        if self.stream_images and n >= self.stream_images:
+            return True
+        return time.time() - last_publish >= self.stream_interval
+
+    def _publish(self, indices):
+        """ Copy images `indices` from scratch data into `data` """
+        with self._values_lock:
+            self.data[:, indices] = self._scratch_data[:, indices]
+            self._values = None
+
+    def _image_reader(self, cancel=None):
+        """ Return a generator reading the current pixel from all images
+
+        Args:
+          cancel (ts_utils.CancelToken, optional): token checked before each
+            image is read; images are skipped once it is cancelled
+
+        Returns:
+          generator: generator that fills `_scratch_data` and yields the
+            index of each image read
+
+        """
+        if self.read_mode == 'block' and self._block_reader is None:
+            self._block_reader = BlockReader(self.block_cache_size,
+                                             pool=self._ds_pool)
+
+        if self.read_workers <= 1 or self.read_mode == 'serial':
+            return self._read_images(cancel)
+        elif self.read_mode == 'process':
+            return self._read_images_process(cancel)
+        elif self.read_mode in ('thread', 'block'):
+            return self._read_images_threaded(cancel)
+        else:
+            raise ValueError('Unknown read mode "%s"' % self.read_mode)
+
+    def _read_image(self, i_img, cancel=None):
+        """ Read current pixel from image `i_img` into scratch data
+
+        Returns:
+          int: `i_img`, or None if `cancel` is cancelled and the image was
+            not read
+
+        """
+        if cancel is not None and cancel.cancelled:
+            return None
+        if self._block_reader is not None:
+            self._block_reader.read_pixel(self.images['path'][i_img],
+                                          self.px, self.py,
+                                          self._scratch_data[:, i_img])
+            return i_img
+        read_pixel_GDAL_into(self.images['path'][i_img],
+                             self.px, self.py,
+                             self._scratch_data[:, i_img],
+                             pool=self._ds_pool)
+        return i_img
+
+    def _read_images(self, cancel=None):
+        """ Read current pixel from each image serially
+
+        Yields:
+          int: index of image read
+
+        """
+        for i_img in range(self.n):
+            if cancel is not None:
+                cancel.check()
+            yield self._read_image(i_img)
+
+    def _read_images_threaded(self, cancel=None):
+        """ Read current pixel from each image using a pool of threads
+
+        GDAL releases the GIL while reading, so reads from multiple images
+        may happen concurrently. The thread pool is kept for the life of the
+        Series so that each thread can reuse its open datasets. If `cancel`
+        is cancelled, outstanding reads are skipped and the pool is drained
+        before returning so no reads continue in the background.
+
+        Yields:
+          int: index of image read, in order of completion
+
+        """
+        if self._read_pool is None:
+            self._read_pool = ThreadPool(min(self.read_workers, self.n))
+        read = partial(self._read_image, cancel=cancel)
+        for i_img in self._read_pool.imap_unordered(read, range(self.n)):
+            if i_img is not None:
+                yield i_img
+
+    def _read_images_process(self, cancel=None):
+        """ Read current pixel from each image using a pool of processes
+
+        The process pool is kept for the life of the Series so that each
+        process can reuse its open datasets.
+
+        Yields:
+          int: index of image read, in order of completion
+
+        """
+        if self._process_reader is None:
+            self._process_reader = ProcessReader(
+                self._scratch_data.shape, self._scratch_data.dtype,
+                min(self.read_workers, self.n), pool_size=self.pool_size)
+        reader = self._process_reader
+        for i_img in reader.read(self.images['path'], self.px, self.py,
+                                 cancel=cancel):
+            self._scratch_data[:, i_img] = reader.data[:, i_img]
+            yield i_img
+
     def _init_images(self, images, date_index=[9, 16], date_format='%Y%j'):
         n = len(images)
         if n == 0:
@@ -207,40 +546,69 @@ class Series(object):
 
         # Extract images information
         _images = np.empty(self.n, dtype=self.images.dtype)
+        _images['path'] = images
+        _images['filename'] = [os.path.basename(img) for img in images]
+        _images['id'] = [os.path.basename(os.path.dirname(img))
+                         for img in images]
 
-        for i, img in enumerate(images):
-            _images[i]['filename'] = os.path.basename(img)
-            _images[i]['path'] = img
-            _images[i]['id'] = os.path.basename(os.path.dirname(img))
+        with ts_utils.profile_phase('parse_dates'):
+            dates = self._parse_dates(_images, date_index, date_format)
+        _images['date'] = dates.astype('M8[us]').astype(object)
+        _images['ordinal'] = dates.astype(np.int64) + _ORDINAL_EPOCH
+        _images['doy'] = (dates - dates.astype('M8[Y]')).astype(np.int64) + 1
+
+        sort_idx = np.argsort(_images['ordinal'])
+        _images = _images[sort_idx]
+
+        self.images = _images.copy()
+
+    def _parse_dates(self, images, date_index, date_format):
+        """ Return dates of images parsed from their ID or filename
 
+        Dates are parsed for all images at once if possible, falling back to
+        parsing each image's ID, and then filename, with `strptime`.
+
+        Returns:
+          np.ndarray: dates as `datetime64[D]`
+
+        """
+        i0, i1 = date_index[0], date_index[1]
+        for column in ('id', 'filename'):
             try:
-                date = _images[i]['id'][date_index[0]:date_index[1]]
-                date = dt.strptime(date, date_format)
+                return ts_utils.parse_dates([_s[i0:i1] for _s in
+                                             images[column]],
+                                            date_format)
+            except ValueError:
+                pass
+
+        dates = np.empty(len(images), dtype='M8[D]')
+        for i, img in enumerate(images):
+            try:
+                date = dt.strptime(img['id'][i0:i1], date_format)
             except:
                 try:
-                    date = _images[i]['filename'][date_index[0]:date_index[1]]
-                    date = dt.strptime(date, date_format)
+                    date = dt.strptime(img['filename'][i0:i1], date_format)
                 except:
                     raise Exception(
                         'Could not parse date from ID or filename '
                         '(date index=%s:%s, format=%s)\n%s\n%s' %
                         (date_index[0], date_index[1], date_format,
-                         _images[i]['id'], _images[i]['filename'])
+                         img['id'], img['filename'])
                     )
-            _images[i]['date'] = date
-            _images[i]['ordinal'] = dt.toordinal(_images[i]['date'])
-            _images[i]['doy'] = int(_images[i]['date'].strftime('%j'))
+            dates[i] = np.datetime64(date.date())
 
-        sort_idx = np.argsort(_images['ordinal'])
-        _images = _images[sort_idx]
+        return dates
 
-        self.images = _images.copy()
+    def _init_attributes(self):
+        """ Read attributes of Series from the first image GDAL can open """
+        self._probed = True
 
-        # Extract attributes
-        self.gt = None
-        self.crs = None
+        with ts_utils.profile_phase('gdal_probe'):
+            self._read_attributes()
+
+    def _read_attributes(self):
         ds = None
-        for fname in images:
+        for fname in self.images['path']:
             try:
                 ds = gdal.Open(fname, gdal.GA_ReadOnly)
             except:
@@ -252,12 +620,14 @@ class Series(object):
                             'could not open any images in Series with GDAL' %
                             self.description)
 
-        self.band_names = []
-        for i_b in range(ds.RasterCount):
-            name = ds.GetRasterBand(i_b + 1).GetDescription()
-            if not name:
-                name = 'Band %s' % str(i_b + 1)
-            self.band_names.append(name)
+        # Band names may be provided by configuration
+        if 'band_names' not in self.__dict__:
+            self.band_names = []
+            for i_b in range(ds.RasterCount):
+                name = ds.GetRasterBand(i_b + 1).GetDescription()
+                if not name:
+                    name = 'Band %s' % str(i_b + 1)
+                self.band_names.append(name)
 
         self.width = ds.RasterXSize
         self.height = ds.RasterYSize
@@ -266,3 +636,81 @@ class Series(object):
             ds.GetRasterBand(1).DataType)
         self.gt = ds.GetGeoTransform()
         self.crs = ds.GetProjection()
+
+    def _init_data(self):
+        """ Allocate data for Series once attributes are known """
+        self.data = np.zeros((self.count, self.n), dtype=self.dtype)
+        self._scratch_data = np.zeros_like(self.data)
+
+    def __getattr__(self, attr):
+        # Only called when `attr` is not found normally, allowing attributes
+        # that require opening an image to be read on first use
+        if attr in _PROBED_ATTRIBUTES and not self.__dict__.get('_probed'):
+            self._init_attributes()
+            return getattr(self, attr)
+        if attr in _DATA_ATTRIBUTES and 'images' in self.__dict__:
+            self._init_data()
+            return getattr(self, attr)
+        raise AttributeError("'%s' object has no attribute '%s'" %
+                             (self.__class__.__name__, attr))
+
+
+class CubeSeries(Series):
+    """ A Series that reads data from a cube built by `cube.build_cube`
+
+    Reads from the images of the Series if a valid cube cannot be opened.
+
+    Attributes:
+      cube_folder (str): directory containing the cube
+
+    """
+    cube_folder = ''
+
+    def __init__(self, filenames, date_index=(9, 16), date_format='%Y%j',
+                 config=None):
+        super(CubeSeries, self).__init__(filenames, date_index, date_format,
+                                         config=config)
+        self.cube = None
+        self.open_cube()
+
+    def open_cube(self):
+        """ Try to open the cube located at `cube_folder`
+
+        Returns:
+          bool: True if the cube could be opened
+
+        """
+        self.cube = None
+        if not self.cube_folder:
+            return False
+        try:
+            self.cube = Cube(self.cube_folder, self)
+        except Exception as e:
+            logger.warning('Could not open cube for %s at %s: %s' %
+                           (self.description, self.cube_folder, e))
+            return False
+        return True
+
+    def close(self):
+        """ Close any GDAL datasets, threads, and cube blocks held open """
+        if self.cube is not None:
+            self.cube.close()
+        super(CubeSeries, self).close()
+
+    def _image_reader(self, cancel=None):
+        if self.cube is None:
+            return super(CubeSeries, self)._image_reader(cancel)
+        return self._read_cube(cancel)
+
+    def _read_cube(self, cancel=None):
+        """ Read current pixel for all images from cube
+
+        Yields:
+          int: index of each image read
+
+        """
+        if cancel is not None:
+            cancel.check()
+        self.cube.read_pixel(self.px, self.py, self._scratch_data)
+        for i_img in range(self.n):
+            yield i_img
@@ -0,0 +1,371 @@
+""" Write synthetic timeseries datasets for testing and benchmarking drivers
+
+Images are written in the layout expected by the "stacked" drivers: one
+directory per image, named by the image ID, containing a multiband image
+matching the default stack pattern (e.g.,
+``LT50120312000001XXX00/LT50120312000001XXX00_stack``) and, optionally, a
+Landsat MTL metadata file. PALSAR (``RADAR/``) and PRISM meteorological
+(``PRISM/``) companions may also be written using the default patterns and
+date formats of the "YATSM Landsat/PALSAR" and "YATSM Meteorological"
+drivers.
+"""
+import datetime as dt
+import logging
+import os
+from xml.sax.saxutils import escape
+
+import numpy as np
+from osgeo import gdal, osr
+
+logger = logging.getLogger('tstools')
+
+gdal.UseExceptions()
+
+# UTM 19N, upper left of WRS-2 path 12 row 31
+_EPSG = 32619
+_ULX, _ULY = 300000.0, 4800000.0
+_RES = 30.0
+
+_GDAL_TYPES = {
+    'uint8': 'Byte',
+    'uint16': 'UInt16',
+    'int16': 'Int16',
+    'int32': 'Int32',
+    'float32': 'Float32'
+}
+
+MET_TYPES = ['ppt', 'tmin', 'tmax', 'tmean']
+
+
+def synthetic_dates(n, start=dt.date(2000, 1, 1), step=16):
+    """ Return dates of `n` images acquired every `step` days
+
+    Args:
+      n (int): number of dates
+      start (datetime.date): date of first image
+      step (int): days between images
+
+    Returns:
+      list: list of datetime.date
+
+    """
+    return [start + dt.timedelta(days=i * step) for i in range(n)]
+
+
+def name_image_ID(date, sensor='LT5', pathrow='012031'):
+    """ Return a Landsat style image ID for a date
+
+    The date is stored as '%Y%j' at index [9, 16], the default date index of
+    the stacked drivers.
+
+    Args:
+      date (datetime.date): acquisition date
+      sensor (str): three character sensor prefix
+      pathrow (str): six character WRS-2 path and row
+
+    Returns:
+      str: image ID
+
+    """
+    return '%s%s%sXXX00' % (sensor, pathrow, date.strftime('%Y%j'))
+
+
+def _srs_wkt(epsg):
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    return srs.ExportToWkt()
+
+
+def write_image(filename, data, gt=None, epsg=_EPSG, driver='GTiff',
+                compress=None, tiled=False, block_size=(256, 256)):
+    """ Write an array to an image
+
+    Args:
+      filename (str): filename to write
+      data (np.ndarray): 3D array (nband, nrow, ncol) to write
+      gt (tuple, optional): geotransform of image
+      epsg (int): EPSG code of image projection
+      driver (str): GDAL driver used to write image
+      compress (str, optional): GeoTIFF compression (e.g., 'DEFLATE', 'LZW')
+      tiled (bool): write a tiled instead of a striped GeoTIFF
+      block_size (tuple): number of rows and columns in each tile
+
+    """
+    nband, nrow, ncol = data.shape
+    gdal_type = gdal.GetDataTypeByName(_GDAL_TYPES[data.dtype.name])
+
+    options = []
+    if driver == 'GTiff':
+        if compress:
+            options.append('COMPRESS=%s' % compress.upper())
+        if tiled:
+            options.extend(['TILED=YES',
+                            'BLOCKYSIZE=%i' % block_size[0],
+                            'BLOCKXSIZE=%i' % block_size[1]])
+
+    ds = gdal.GetDriverByName(driver).Create(filename, ncol, nrow, nband,
+                                             gdal_type, options)
+    ds.SetGeoTransform(gt or (_ULX, _RES, 0, _ULY, 0, -_RES))
+    ds.SetProjection(_srs_wkt(epsg))
+    for b in range(nband):
+        ds.GetRasterBand(b + 1).WriteArray(data[b])
+    ds = None
+
+
+def write_vrt(filename, sources, shape, dtype, gt=None, epsg=_EPSG):
+    """ Write a VRT stacking the first band of each source image
+
+    Args:
+      filename (str): filename to write
+      sources (list): filenames of source images, relative to `filename`
+      shape (tuple): number of rows and columns of sources
+      dtype (np.dtype): datatype of sources
+      gt (tuple, optional): geotransform of sources
+      epsg (int): EPSG code of sources' projection
+
+    """
+    gdal_type = _GDAL_TYPES[np.dtype(dtype).name]
+    gt = gt or (_ULX, _RES, 0, _ULY, 0, -_RES)
+
+    lines = ['<VRTDataset rasterXSize="%i" rasterYSize="%i">' %
+             (shape[1], shape[0]),
+             '  <SRS>%s</SRS>' % escape(_srs_wkt(epsg)),
+             '  <GeoTransform>%s</GeoTransform>' %
+             ', '.join(repr(float(v)) for v in gt)]
+    for i, source in enumerate(sources):
+        lines.extend([
+            '  <VRTRasterBand dataType="%s" band="%i">' % (gdal_type, i + 1),
+            '    <SimpleSource>',
+            '      <SourceFilename relativeToVRT="1">%s</SourceFilename>' %
+            escape(source),
+            '      <SourceBand>1</SourceBand>',
+            '    </SimpleSource>',
+            '  </VRTRasterBand>'])
+    lines.append('</VRTDataset>')
+
+    with open(filename, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def write_MTL(filename, ID, date, cloud_cover):
+    """ Write a minimal Landsat MTL metadata file
+
+    Args:
+      filename (str): filename to write
+      ID (str): image ID
+      date (datetime.date): acquisition date
+      cloud_cover (float): percent cloud cover
+
+    """
+    with open(filename, 'w') as f:
+        f.write('GROUP = L1_METADATA_FILE\n'
+                '  GROUP = METADATA_FILE_INFO\n'
+                '    LANDSAT_SCENE_ID = "%s"\n'
+                '  END_GROUP = METADATA_FILE_INFO\n'
+                '  GROUP = PRODUCT_METADATA\n'
+                '    DATE_ACQUIRED = %s\n'
+                '  END_GROUP = PRODUCT_METADATA\n'
+                '  GROUP = IMAGE_ATTRIBUTES\n'
+                '    CLOUD_COVER = %.2f\n'
+                '  END_GROUP = IMAGE_ATTRIBUTES\n'
+                'END_GROUP = L1_METADATA_FILE\n'
+                'END\n' % (ID, date.isoformat(), cloud_cover))
+
+
+def write_stack(location, n_images=100, shape=(100, 100), n_bands=8,
+                mask_values=(2, 3, 4, 255), clear_fraction=0.7, mtl=False,
+                seed=0, **options):
+    """ Write a synthetic stack of Landsat-like images
+
+    Bands before the last contain noisy, seasonal reflectance values. The
+    last band is a mask band where `clear_fraction` of pixels are clear (0)
+    and the remainder are drawn from `mask_values`.
+
+    Args:
+      location (str): directory to write images into
+      n_images (int): number of images
+      shape (tuple): number of rows and columns in each image
+      n_bands (int): number of bands, including the mask band
+      mask_values (iterable): values of masked observations in mask band
+        (e.g., `StackedTimeSeries.mask_values`)
+      clear_fraction (float): fraction of observations that are not masked
+      mtl (bool): also write a MTL metadata file for each image
+      seed (int): seed for random number generator
+      options: additional options passed to `write_image` (e.g.,
+        `compress`, `tiled`, and `block_size`)
+
+    Returns:
+      list: filenames of images written
+
+    """
+    rng = np.random.RandomState(seed)
+    nrow, ncol = shape
+    mask_values = np.asarray(mask_values)
+
+    filenames = []
+    for i, date in enumerate(synthetic_dates(n_images)):
+        ID = name_image_ID(date, sensor='LT5' if i % 2 == 0 else 'LE7')
+        d = os.path.join(location, ID)
+        if not os.path.isdir(d):
+            os.makedirs(d)
+
+        season = np.sin(2 * np.pi * date.timetuple().tm_yday / 365.25)
+        data = np.empty((n_bands, nrow, ncol), dtype=np.int16)
+        for b in range(n_bands - 1):
+            data[b] = (1000 * (b + 1) + 500 * season +
+                       rng.normal(0, 100, shape)).astype(np.int16)
+        clear = rng.rand(nrow, ncol) < clear_fraction
+        if mask_values.size:
+            data[-1] = np.where(clear, 0, rng.choice(mask_values, shape))
+        else:
+            data[-1] = 0
+
+        fn = os.path.join(d, ID + '_stack')
+        write_image(fn, data, **options)
+        filenames.append(fn)
+
+        if mtl:
+            write_MTL(os.path.join(d, ID + '_MTL.txt'), ID, date,
+                      100.0 * (1 - clear.mean()))
+
+    logger.debug('Wrote %i synthetic images to %s' % (n_images, location))
+    return filenames
+
+
+def write_palsar(location, n_images=10, shape=(100, 100), seed=0,
+                 **options):
+    """ Write synthetic PALSAR HH and HV images and HH/HV/ratio VRTs
+
+    Each image is written to its own directory, named with the date at index
+    [8, 16] in '%Y%m%d' format (e.g., ``ALPSRP0120000101``), containing
+    ``*hh.gtif`` and ``*hv.gtif`` images and a ``*.vrt`` stacking HH, HV,
+    and a third band that is replaced by the HH/HV ratio when read.
+
+    Args:
+      location (str): directory to write images into (e.g., ``RADAR/``)
+      n_images (int): number of images
+      shape (tuple): number of rows and columns in each image
+      seed (int): seed for random number generator
+      options: additional options passed to `write_image`
+
+    Returns:
+      list: filenames of HH images written
+
+    """
+    rng = np.random.RandomState(seed)
+
+    filenames = []
+    for date in synthetic_dates(n_images, step=46):
+        ID = 'ALPSRP01%s' % date.strftime('%Y%m%d')
+        d = os.path.join(location, ID)
+        if not os.path.isdir(d):
+            os.makedirs(d)
+
+        sources = []
+        for pol, mean in (('hh', 120), ('hv', 80)):
+            data = rng.normal(mean, 10, (1, ) + tuple(shape))
+            fn = ID + '_%s.gtif' % pol
+            write_image(os.path.join(d, fn),
+                        np.clip(data, 1, 255).astype(np.uint16), **options)
+            sources.append(fn)
+        sources.append(sources[0])
+
+        write_vrt(os.path.join(d, ID + '_hhhv.vrt'), sources, shape,
+                  np.uint16)
+        filenames.append(os.path.join(d, sources[0]))
+
+    logger.debug('Wrote %i synthetic PALSAR images to %s' %
+                 (n_images, location))
+    return filenames
+
+
+def write_prism(location, start, end, shape=(10, 10), res=_RES * 10,
+                met_types=MET_TYPES, seed=0):
+    """ Write synthetic monthly PRISM meteorological data
+
+    Data are written as ``<location>/<met_type>/PRISM_<met_type>_stable_
+    4kmM2_<%Y%m>_bil.bil`` so the date is '_' separated field 4 (counting
+    from 0), the default of the "YATSM Meteorological" driver.
+
+    Args:
+      location (str): directory to write data into (e.g., ``PRISM/``)
+      start (datetime.date): first month to write
+      end (datetime.date): last month to write
+      shape (tuple): number of rows and columns in each image
+      res (float): pixel size of images
+      met_types (list): types of meteorological data to write
+      seed (int): seed for random number generator
+
+    Returns:
+      list: filenames of images written
+
+    """
+    rng = np.random.RandomState(seed)
+    gt = (_ULX, res, 0, _ULY, 0, -res)
+
+    months = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        months.append(dt.date(year, month, 1))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    filenames = []
+    for met_type in met_types:
+        d = os.path.join(location, met_type)
+        if not os.path.isdir(d):
+            os.makedirs(d)
+        for date in months:
+            season = np.sin(2 * np.pi * (date.month - 4) / 12.0)
+            if met_type == 'ppt':
+                data = rng.gamma(2, 50, (1, ) + tuple(shape))
+            else:
+                data = 10 + 15 * season + rng.normal(0, 2,
+                                                     (1, ) + tuple(shape))
+            fn = os.path.join(d, 'PRISM_%s_stable_4kmM2_%s_bil.bil' %
+                              (met_type, date.strftime('%Y%m')))
+            write_image(fn, data.astype(np.float32), gt=gt, driver='EHdr')
+            filenames.append(fn)
+
+    logger.debug('Wrote %i synthetic PRISM images to %s' %
+                 (len(filenames), location))
+    return filenames
+
+
+def write_dataset(location, n_images=100, shape=(100, 100), n_bands=8,
+                  mtl=True, palsar=True, prism=True, seed=0, **options):
+    """ Write a synthetic Landsat stack and any companion datasets
+
+    Args:
+      location (str): directory to write dataset into
+      n_images (int): number of Landsat images
+      shape (tuple): number of rows and columns in each Landsat image
+      n_bands (int): number of bands in each Landsat image, including the
+        mask band
+      mtl (bool): write MTL metadata files for Landsat images
+      palsar (bool): write PALSAR images into ``RADAR/``
+      prism (bool): write PRISM data into ``PRISM/`` covering the dates of
+        the Landsat images
+      seed (int): seed for random number generator
+      options: additional options passed to `write_image` (e.g.,
+        `compress`, `tiled`, and `block_size`)
+
+    Returns:
+      dict: filenames of images written for 'stack', 'palsar', and 'prism'
+
+    """
+    written = {
+        'stack': write_stack(location, n_images=n_images, shape=shape,
+                             n_bands=n_bands, mtl=mtl, seed=seed, **options)
+    }
+    if palsar:
+        written['palsar'] = write_palsar(
+            os.path.join(location, 'RADAR'),
+            n_images=max(1, n_images // 3), shape=shape, seed=seed, **options)
+    if prism:
+        dates = synthetic_dates(n_images)
+        written['prism'] = write_prism(
+            os.path.join(location, 'PRISM'), dates[0], dates[-1],
+            shape=(max(1, shape[0] // 10), max(1, shape[1] // 10)),
+            seed=seed)
+
+    return written
@@ -4,11 +4,59 @@ The AbstractTimeSeriesDriver defines all the properties and methods required
 of a timeseries driver for auto-detection and use within the TSTools plugin.
 """
 import abc
+from functools import wraps
+import inspect
+
+import numpy as np
 
 from . import ts_utils
 from .series import Series
 
 
+def _memo_key(value):
+    """ Return a hashable key for an argument of a memoized method """
+    if isinstance(value, np.ndarray):
+        return (value.dtype.str, value.shape, value.tobytes())
+    if isinstance(value, (list, tuple)):
+        return tuple(_memo_key(v) for v in value)
+    return value
+
+
+def memoize(func):
+    """ Remember results of a driver method until its data or results change
+
+    Results are stored in the driver's `_memo`, keyed by the method and
+    its arguments (NumPy arrays are keyed by their contents), and are
+    forgotten when drivers call `clear_memo`. Results are returned as
+    stored, so callers must not modify them.
+
+    Args:
+      func (callable): driver method to memoize
+
+    Returns:
+      callable: memoized method
+
+    """
+    @wraps(func)
+    def memoized(self, *args, **kwargs):
+        callargs = inspect.getcallargs(func, self, *args, **kwargs)
+        callargs.pop('self')
+        try:
+            key = (func.__name__, _memo_key(sorted(callargs.items())))
+            hash(key)
+        except TypeError:
+            return func(self, *args, **kwargs)
+
+        # Store into the memo current when computation started so results
+        # computed while the memo is cleared in another thread are dropped
+        memo = self._memo
+        if key not in memo:
+            memo[key] = func(self, *args, **kwargs)
+        return memo[key]
+
+    return memoized
+
+
 class AbstractTimeSeriesDriver(object):
     """ Abstract base class representing a remote sensing time series.
 
@@ -52,6 +100,9 @@ class AbstractTimeSeriesDriver(object):
     Extra Methods:
       set_custom_controls(values): setter for custom control variables defined
         in `controls`. Required to enable custom controls
+      clear_memo: forget results of methods decorated with `memoize`. Drivers
+        should call this when data, mask, controls, or results change
+      close: release resources (e.g., open datasets) held by each `Series`
 
     """
 
@@ -68,6 +119,7 @@ class AbstractTimeSeriesDriver(object):
 
     def __init__(self, location, config=None):
         self.location = location
+        self._memo = {}
         if config:
             ts_utils.set_custom_config(self, config)
 
@@ -103,7 +155,7 @@ class AbstractTimeSeriesDriver(object):
         pass
 
     @abc.abstractmethod
-    def fetch_data(self, x, y, crs_wkt):
+    def fetch_data(self, x, y, crs_wkt, cancel=None, publish=None):
         """ Read data for a given x, y coordinate in a given CRS
 
         Args:
@@ -111,10 +163,20 @@ class AbstractTimeSeriesDriver(object):
           my (float): map Y location
           crs_wkt (str): Well Known Text (Wkt) Coordinate reference system
             string describing (x, y)
+          cancel (ts_utils.CancelToken, optional): token used to cancel the
+            fetch
+          publish (callable, optional): if supported by the driver, called
+            with the index of a Series and indices of its images each time
+            a batch of data is available from `get_data` before the fetch
+            completes
 
         Yields:
           float: current retrieval progress (0 to 1)
 
+        Raises:
+          ts_utils.FetchCancelled: raise FetchCancelled if `cancel` is
+            cancelled before data are read
+
         """
         pass
 
@@ -210,6 +272,17 @@ class AbstractTimeSeriesDriver(object):
         """
         pass
 
+    def clear_memo(self):
+        """ Forget results of methods decorated with `memoize`
+        """
+        self._memo = {}
+
+    def close(self):
+        """ Release any resources held by Series within the driver """
+        for series in self.series:
+            if hasattr(series, 'close'):
+                series.close()
+
     def get_plot(self, series, band, axis, desc):
         """ Plot some information on an axis for a plot of some description
 
@@ -8,7 +8,7 @@ import numpy as np
 import scipy.io as spio
 
 from . import timeseries_stacked
-from .timeseries import Series
+from .timeseries import Series, memoize
 from .ts_utils import find_files
 from .. import settings
 
@@ -44,13 +44,19 @@ class CCDCTimeSeries(timeseries_stacked.StackedTimeSeries):
               '_date_format',
               '_cache_folder',
               '_mask_band',
-              '_results_folder']
+              '_results_folder',
+              '_read_mode',
+              '_read_workers',
+              '_prefetch_lines']
     config_names = ['Stack pattern',
                     'Index of date in ID',
                     'Date format',
                     'Cache folder',
                     'Mask band',
-                    'Results folder']
+                    'Results folder',
+                    'Read mode (serial/thread/process/block)',
+                    'Read workers',
+                    'Prefetch lines around query']
 
     def fetch_results(self):
         """ Read results for current pixel
@@ -73,7 +79,13 @@ class CCDCTimeSeries(timeseries_stacked.StackedTimeSeries):
                          (row, self.series[0].px + 1))
             return
         self.ccdc_results = ccdc_results[pos_search]
+        self.clear_memo()
 
+    def _reset_results(self):
+        """ Forget results of the previous pixel """
+        self.ccdc_results = None
+
+    @memoize
     def get_prediction(self, series, band, dates=None):
         """ Return prediction for a given band
 
@@ -134,6 +146,7 @@ class CCDCTimeSeries(timeseries_stacked.StackedTimeSeries):
 
         return mx, my
 
+    @memoize
     def get_breaks(self, series, band):
         """ Return break points for a given band
 
@@ -163,7 +176,8 @@ class CCDCTimeSeries(timeseries_stacked.StackedTimeSeries):
                                      == _bx)[0]
                     if (index.size > 0 and index[0] < n_obs):
                         bx.append(_bx)
-                        by.append(self.series[series].data[band, index[0]])
+                        by.append(
+                            self.series[series].get_values()[band, index[0]])
                     else:
                         logger.warning('Could not determine breakpoint')
 
@@ -181,12 +195,17 @@ class CCDCTimeSeries(timeseries_stacked.StackedTimeSeries):
             residual dates and values
 
         """
+        return self._get_residuals(series, band, settings.plot['mask'])
+
+    @memoize
+    def _get_residuals(self, series, band, mask):
+        """ Return residuals of data masked or left unmasked """
         if self.ccdc_results is None:
             return
 
         rx, ry = [], []
 
-        X, y = self.get_data(series, band, mask=settings.plot['mask'])
+        X, y = self.get_data(series, band, mask=mask)
         date, yhat = self.get_prediction(series, band, dates=X['ordinal'])
 
         for _date, _yhat in zip(date, yhat):
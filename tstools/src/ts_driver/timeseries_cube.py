@@ -0,0 +1,78 @@
+""" Timeseries driver for a 'stacked' timeseries read from a consolidated cube
+"""
+import logging
+import os
+
+from . import cube
+from .series import CubeSeries
+from .timeseries_stacked import StackedTimeSeries
+
+logger = logging.getLogger('tstools')
+
+
+class CubeTimeSeries(StackedTimeSeries):
+    """ 'Stacked' timeseries driver reading from a consolidated cube
+
+    Each Series is converted into a cube (see `cube.build_cube`) stored within
+    the cube folder so that a pixel query reads one contiguous chunk instead
+    of one pixel from every image. Cubes are built outside of QGIS with
+    ``python -m tstools.ts_driver.cube``. Series without a valid cube are
+    read from their images.
+
+    """
+    description = 'Layer Stacked Timeseries (Cube)'
+
+    # Driver configuration
+    _cube_folder = 'cube'
+    _cube_block_size = [64, 64]
+
+    config = [c for c in StackedTimeSeries.config]
+    config.extend([
+        '_cube_folder',
+        '_cube_block_size'
+    ])
+    config_names = [cn for cn in StackedTimeSeries.config_names]
+    config_names.extend([
+        'Cube folder',
+        'Cube block size (rows, columns)'
+    ])
+
+    _series_class = CubeSeries
+
+    def __init__(self, location, config=None):
+        super(CubeTimeSeries, self).__init__(location, config=config)
+
+        for i, series in enumerate(self.series):
+            series.cube_folder = os.path.join(self.location,
+                                              self._cube_folder,
+                                              'series%i' % i)
+            series.open_cube()
+
+    def build_cube(self, i_series, max_bytes=256 * 1024 ** 2, cancel=None):
+        """ Build (or rebuild) the cube for a Series and open it
+
+        Args:
+          i_series (int): index of Series to build
+          max_bytes (int): maximum size of images read into memory at once
+          cancel (ts_utils.CancelToken, optional): token checked while the
+            cube is built
+
+        Yields:
+          float: current progress (0 to 100)
+
+        Raises:
+          ts_utils.FetchCancelled: raise FetchCancelled if `cancel` is
+            cancelled
+
+        """
+        series = self.series[i_series]
+        logger.info('Building cube for %s in %s' %
+                    (series.description, series.cube_folder))
+        if series.cube is not None:
+            series.cube.close()
+            series.cube = None
+        for progress in cube.build_cube(series, series.cube_folder,
+                                        block_size=self._cube_block_size,
+                                        max_bytes=max_bytes, cancel=cancel):
+            yield progress
+        series.open_cube()
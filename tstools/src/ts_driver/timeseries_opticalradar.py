@@ -7,13 +7,32 @@ import os
 import numpy as np
 import patsy
 
+from . import ts_utils
 from .timeseries import Series
 from .timeseries_yatsm import YATSMTimeSeries
-from .ts_utils import find_files, parse_landsat_MTL
 
 logger = logging.getLogger('tstools')
 
 
+def palsar_dn_to_dB(data):
+    """ Convert PALSAR DNs to dB: dB = ( DN - 1 ) * 0.15 - 31.0
+
+    If HH and HV are both provided, the third band is replaced by the ratio
+    of HH to HV in dB.
+
+    Args:
+      data (np.ndarray): 2D array (nband, ntime) of PALSAR DNs
+
+    Returns:
+      np.ndarray: 2D array (nband, ntime) of PALSAR backscatter in dB
+
+    """
+    dB = (data.astype(np.float) - 1) * 0.15 - 31.0
+    if dB.shape[0] > 2:
+        dB[2, :] = dB[0, :] / dB[1, :]
+    return dB
+
+
 class YATSMLandsatPALSARTS(YATSMTimeSeries):
 
     """ Timeseries driver for Timeseries of Landsat/PALSAR timeseries
@@ -42,6 +61,18 @@ class YATSMLandsatPALSARTS(YATSMTimeSeries):
         'PALSAR date index'
     ])
 
+    # Find RADAR images with the Landsat images and metadata
+    _inventory_patterns = YATSMTimeSeries._inventory_patterns + [
+        '_ps_hh_pattern', '_ps_vrt_pattern']
+
+    @property
+    def _ps_hh_pattern(self):
+        return self._ps_stack_pattern + '*hh.gtif'
+
+    @property
+    def _ps_vrt_pattern(self):
+        return self._ps_stack_pattern + '*.vrt'
+
     def __init__(self, location, config=None):
         super(YATSMLandsatPALSARTS, self).__init__(location, config=config)
 
@@ -49,57 +80,29 @@ class YATSMLandsatPALSARTS(YATSMTimeSeries):
         self.series[0].description = 'Landsat Timeseries'
 
         # Add series for RADAR HH/HV/ratio
-        self._find_radar()
-
-    def fetch_data(self, mx, my, crs_wkt):
-        """ Read data for a given x, y coordinate in a given CRS
-
-        Args:
-          mx (float): map X location
-          my (float): map Y location
-          crs_wkt (str): Well Known Text (Wkt) Coordinate reference system
-            string describing (x, y)
-
-        Yields:
-          float: current retrieval progress (0 to 1)
-
-        Raises:
-          IndexError: raise IndexError if map coordinates are outside of
-            dataset
-
-        """
-        for progress in super(YATSMLandsatPALSARTS, self).fetch_data(
-                mx, my, crs_wkt):
-            yield progress
-
-        # Convert RADAR DNs to dB: dB = ( DN - 1 ) * 0.15 - 31.0
-        for series in self.series[1:]:
-            if series.data is None:
-                continue
-            logger.debug('Rescaling %s to dB' % (series.description, ))
-            logger.debug(series.data.shape)
-            series.data[0, :] = (series.data[0, :] - 1) * 0.15 - 31.0
-            if series.data.shape[0] > 1:
-                series.data[1, :] = (series.data[1, :] - 1) * 0.15 - 31.0
-                series.data[2, :] = series.data[0, :] / series.data[1, :]
-            logger.debug('Rescaled. Data min/max: {0}/{1}'.format(
-                         series.data.min(axis=1), series.data.max(axis=1)))
+        with ts_utils.profile_phase('find_radar'):
+            self._find_radar()
 
     def _find_radar(self):
         """ Find RADAR images and initialize series
+
+        RADAR images are found by the search of the driver's location, unless
+        the RADAR directory is elsewhere.
         """
-        location = os.path.join(self.location, self._ps_dir)
-
-        # Ignore results folder and cache, if we have it
-        ignore_dirs = []
-        if hasattr(self, '_cache_folder'):
-            ignore_dirs.append(getattr(self, '_cache_folder'))
-        if hasattr(self, '_results_folder'):
-            ignore_dirs.append(getattr(self, '_results_folder'))
-
-        # Find HH images
-        hh_images = find_files(location, self._ps_stack_pattern + '*hh.gtif',
-                               ignore_dirs=ignore_dirs)
+        root = os.path.abspath(self.location)
+        location = os.path.abspath(os.path.join(root, self._ps_dir))
+        patterns = [self._ps_hh_pattern, self._ps_vrt_pattern]
+
+        # Find HH and HH/HV/Ratio VRT images
+        if location.startswith(root + os.path.sep):
+            prefix = location + os.path.sep
+            found = dict((pattern, [img for img in self._files[pattern]
+                                    if img.startswith(prefix)])
+                         for pattern in patterns)
+        else:
+            found = self._inventory(location, patterns)
+
+        hh_images = found[self._ps_hh_pattern]
         if not hh_images:
             raise Exception('Could not find any HH images (*hh.gtif)')
         self.series.append(Series(
@@ -108,13 +111,14 @@ class YATSMLandsatPALSARTS(YATSMTimeSeries):
                 'description': 'PALSAR HH Timeseries',
                 'symbology_hint_indices': [0],
                 'symbology_hint_minmax': [0, 255],
-                'band_names': ['HH']
+                'band_names': ['HH'],
+                'data_transform': palsar_dn_to_dB,
+                'read_mode': self._read_mode,
+                'read_workers': self._read_workers
             }
         ))
 
-        # Find HH/HV/Ratio VRT images
-        vrt_images = find_files(location, self._ps_stack_pattern + '*.vrt',
-                                ignore_dirs=ignore_dirs)
+        vrt_images = found[self._ps_vrt_pattern]
         if not vrt_images:
             raise Exception('Could not find any HH/HV/Ratio images (*.vrt)')
         self.series.append(Series(
@@ -123,6 +127,9 @@ class YATSMLandsatPALSARTS(YATSMTimeSeries):
                 'description': 'PALSAR HH/HV/Ratio Timeseries',
                 'symbology_hint_indices': [0, 1, 2],
                 'symbology_hint_minmax': [0, 255],
-                'band_names': ['HH', 'HV', 'HH/HV']
+                'band_names': ['HH', 'HV', 'HH/HV'],
+                'data_transform': palsar_dn_to_dB,
+                'read_mode': self._read_mode,
+                'read_workers': self._read_workers
             }
         ))
@@ -1,13 +1,15 @@
 """ Timeseries driver for a simple 'stacked' timeseries dataset
 """
+from functools import partial
 import logging
 import os
+import threading
 
 import numpy as np
 
 from . import ts_utils
 from .series import Series
-from .timeseries import AbstractTimeSeriesDriver
+from .timeseries import AbstractTimeSeriesDriver, memoize
 from ..utils import geo_utils
 
 logger = logging.getLogger('tstools')
@@ -34,51 +36,69 @@ class StackedTimeSeries(AbstractTimeSeriesDriver):
     _date_format = '%Y%j'
     _cache_folder = 'cache'
     _mask_band = [8]
+    _read_mode = 'thread'
+    _read_workers = 1
+    _prefetch_lines = 0
 
     config = ['_stack_pattern',
               '_date_index',
               '_date_format',
               '_cache_folder',
-              '_mask_band']
+              '_mask_band',
+              '_read_mode',
+              '_read_workers',
+              '_prefetch_lines']
     config_names = ['Stack pattern',
                     'Index of date in ID',
                     'Date format',
                     'Cache folder',
-                    'Mask band']
+                    'Mask band',
+                    'Read mode (serial/thread/process/block)',
+                    'Read workers',
+                    'Prefetch lines around query']
 
     _read_cache, _write_cache = False, False
+    _series_class = Series
+    # Attributes containing patterns of files to find when initializing
+    _inventory_patterns = ['_stack_pattern']
+    _prefetch_thread = None
+    _prefetch_stop = None
 
     def __init__(self, location, config=None):
         super(StackedTimeSeries, self).__init__(location, config=config)
-
-        # Find images and init Series
-        ignore_dirs = []
-        if hasattr(self, '_cache_folder'):
-            ignore_dirs.append(self._cache_folder)
-        if hasattr(self, '_results_folder'):
-            ignore_dirs.append(self._results_folder)
-        images = ts_utils.find_files(self.location, self._stack_pattern,
-                                     ignore_dirs=ignore_dirs)
-
-        self.series = [
-            Series(
-                images,
-                self._date_index, self._date_format,
-                {
-                    'description': 'Stacked TS',
-                    'symbology_hint_indices': [4, 3, 2],
-                    'symbology_hint_minmax': [[0, 4000], [0, 5000], [0, 3000]],
-                    'cache_prefix': 'yatsm_',
-                    'cache_suffix': '.npy'
-                })
-        ]
-        self._check_cache()
+        self._check_cache(create=False)
+
+        # Find images, and any other files needed, and init Series
+        patterns = [getattr(self, attr) for attr in self._inventory_patterns
+                    if getattr(self, attr, None)]
+        with ts_utils.profile_phase('find_files'):
+            self._files = self._inventory(self.location, patterns)
+        images = self._files[self._stack_pattern]
+        if images:
+            self._check_cache()
+
+        with ts_utils.profile_phase('init_series'):
+            self.series = [
+                self._series_class(
+                    images,
+                    self._date_index, self._date_format,
+                    {
+                        'description': 'Stacked TS',
+                        'symbology_hint_indices': [4, 3, 2],
+                        'symbology_hint_minmax': [[0, 4000], [0, 5000],
+                                                  [0, 3000]],
+                        'cache_prefix': 'yatsm_',
+                        'cache_suffix': '.npy',
+                        'read_mode': self._read_mode,
+                        'read_workers': self._read_workers
+                    })
+            ]
 
     @property
     def pixel_pos(self):
         return self._pixel_pos
 
-    def fetch_data(self, mx, my, crs_wkt):
+    def fetch_data(self, mx, my, crs_wkt, cancel=None, publish=None):
         """ Read data for a given x, y coordinate in a given CRS
 
         Args:
@@ -86,6 +106,11 @@ class StackedTimeSeries(AbstractTimeSeriesDriver):
           my (float): map Y location
           crs_wkt (str): Well Known Text (Wkt) Coordinate reference system
             string describing (x, y)
+          cancel (ts_utils.CancelToken, optional): token checked between
+            image reads of each Series
+          publish (callable, optional): called with the index of a Series
+            and indices of its images as data are streamed from its images
+            (see `Series.fetch_data`)
 
         Yields:
           float: current retrieval progress (0 to 1)
@@ -93,6 +118,9 @@ class StackedTimeSeries(AbstractTimeSeriesDriver):
         Raises:
           IndexError: raise IndexError if map coordinates are outside of
             dataset
+          ts_utils.FetchCancelled: raise FetchCancelled if `cancel` is
+            cancelled before all Series are read. All Series, including
+            those read before cancellation, keep the previous pixel
 
         """
         cache_folder = os.path.join(self.location, self._cache_folder)
@@ -100,20 +128,40 @@ class StackedTimeSeries(AbstractTimeSeriesDriver):
         i = 0
         n = sum([len(series.images) for series in self.series])
 
-        descs, rowcol = [], []
-        for j, series in enumerate(self.series):
-            _mx, _my = geo_utils.reproject_point(mx, my, crs_wkt, series.crs)
-            _px, _py = geo_utils.point2pixel(_mx, _my, series.gt)
-
-            descs.append(series.description)
-            rowcol.append('%i/%i' % (_py, _px))
+        self.clear_memo()
+        previous = [(series.data.copy(), series.px, series.py)
+                    for series in self.series]
 
-            for _i in series.fetch_data(mx, my, crs_wkt,
-                                        cache_folder=cache_folder,
-                                        read_cache=self._read_cache,
-                                        write_cache=self._write_cache):
-                i += _i
-                yield i / float(n) * 100.0
+        descs, rowcol = [], []
+        try:
+            for j, series in enumerate(self.series):
+                if cancel is not None:
+                    cancel.check()
+                _mx, _my = geo_utils.reproject_point(mx, my, crs_wkt,
+                                                     series.crs)
+                _px, _py = geo_utils.point2pixel(_mx, _my, series.gt)
+
+                _publish = (partial(self._publish, publish, j)
+                            if publish is not None else None)
+
+                descs.append(series.description)
+                rowcol.append('%i/%i' % (_py, _px))
+
+                for _i in series.fetch_data(mx, my, crs_wkt,
+                                            cache_folder=cache_folder,
+                                            read_cache=self._read_cache,
+                                            write_cache=self._write_cache,
+                                            cancel=cancel,
+                                            publish=_publish):
+                    yield (i + _i) / float(n) * 100.0
+                i += len(series.images)
+        except Exception:
+            # Results still describe the previous pixel, so every Series
+            # keeps its data if the fetch is cancelled or fails
+            for series, (data, px, py) in zip(self.series, previous):
+                series.restore(data, px, py)
+            self.update_mask()
+            raise
 
         # Collapse pixel position if same row/column
         pos = []
@@ -126,13 +174,23 @@ class StackedTimeSeries(AbstractTimeSeriesDriver):
 
         self._pixel_pos = 'Row/Col: ' + '; '.join(pos)
 
+        # Results of the previous pixel no longer apply
+        self._reset_results()
+
         # Update mask
         self.update_mask()
 
+        if self._prefetch_lines > 0 and self._write_cache:
+            self._prefetch(cache_folder)
+
     def fetch_results(self):
         """ Read or calculate results for current pixel """
         pass
 
+    def _reset_results(self):
+        """ Forget results of the previous pixel """
+        pass
+
     def update_mask(self, mask_values=None):
         """ Update data mask. Optionally also update mask values
 
@@ -148,7 +206,9 @@ class StackedTimeSeries(AbstractTimeSeriesDriver):
                 continue
             series.mask = np.in1d(series.data[mask_band - 1, :],
                                   self.mask_values, invert=True)
+        self.clear_memo()
 
+    @memoize
     def get_data(self, series, band, mask=True, indices=None):
         """ Return data for a given band
 
@@ -166,8 +226,7 @@ class StackedTimeSeries(AbstractTimeSeriesDriver):
 
         """
         X = self.series[series].images
-        # y = self.series[series].data[band, :]
-        y = self.series[series].data.take(band, axis=0)
+        y = self.series[series].get_values().take(band, axis=0)
 
         if mask is True:
             mask = self.series[series].mask
@@ -195,6 +254,15 @@ class StackedTimeSeries(AbstractTimeSeriesDriver):
     def get_residuals(self, series, band):
         pass
 
+    def close(self):
+        """ Stop any background caching and release Series resources """
+        if self._prefetch_stop is not None:
+            self._prefetch_stop.set()
+        if self._prefetch_thread is not None:
+            self._prefetch_thread.join()
+            self._prefetch_thread = None
+        super(StackedTimeSeries, self).close()
+
     def get_geometry(self):
         """ Return geometry and projection for data queried
 
@@ -217,8 +285,81 @@ class StackedTimeSeries(AbstractTimeSeriesDriver):
 
         return geom, crs
 
-    def _check_cache(self):
+    def _publish(self, publish, i_series, indices):
+        """ Update mask and pass images streamed from a Series on """
+        self.update_mask()
+        publish(i_series, indices)
+
+    def _prefetch(self, cache_folder):
+        """ Cache lines surrounding the last pixel queried in background
+
+        Only one prefetch runs at a time; requests made while a prefetch is
+        running are ignored.
+
+        Args:
+          cache_folder (str): path to cache folder
+
+        """
+        if (self._prefetch_thread is not None and
+                self._prefetch_thread.is_alive()):
+            logger.debug('Prefetch already running')
+            return
+
+        rows = [series.py - self._prefetch_lines for series in self.series]
+        self._prefetch_stop = threading.Event()
+        self._prefetch_thread = threading.Thread(
+            target=self._prefetch_run,
+            args=(rows, cache_folder, self._prefetch_stop))
+        self._prefetch_thread.daemon = True
+        self._prefetch_thread.start()
+
+    def _prefetch_run(self, rows, cache_folder, stop):
+        nrow = 2 * self._prefetch_lines + 1
+        for row, series in zip(rows, self.series):
+            try:
+                series.cache_lines(row, nrow, cache_folder, stop=stop)
+            except Exception as e:
+                logger.warning('Could not prefetch lines for %s: %s' %
+                               (series.description, e))
+
+    def _inventory(self, location, patterns):
+        """ Find files matching several patterns with one search
+
+        Cache, results, and cube folders are ignored. If the cache folder
+        exists and is writable, a manifest of the search is kept within it so
+        that unchanged directories are not listed again.
+
+        Args:
+          location (str): root directory to search
+          patterns (iterable): glob style patterns to search for
+
+        Returns:
+          dict: list of files within location matching each pattern
+
+        """
+        ignore_dirs = []
+        if hasattr(self, '_cache_folder'):
+            ignore_dirs.append(self._cache_folder)
+        if hasattr(self, '_results_folder'):
+            ignore_dirs.append(self._results_folder)
+        if hasattr(self, '_cube_folder'):
+            ignore_dirs.append(self._cube_folder)
+
+        manifest = None
+        if self._write_cache:
+            manifest = os.path.join(
+                self.cache_folder, ts_utils.name_inventory_manifest(location))
+
+        return ts_utils.inventory_files(location, patterns,
+                                        ignore_dirs=ignore_dirs,
+                                        manifest=manifest)
+
+    def _check_cache(self, create=True):
         """ Check for read/write from/to cache folder
+
+        Args:
+          create (bool): create the cache folder if it does not exist
+
         """
         self.cache_folder = os.path.join(self.location, self._cache_folder)
         if (os.path.exists(self.cache_folder) and
@@ -228,7 +369,7 @@ class StackedTimeSeries(AbstractTimeSeriesDriver):
 
             if os.access(self.cache_folder, os.W_OK):
                 self._write_cache = True
-        else:
+        elif create:
             try:
                 os.mkdir(self.cache_folder)
             except:
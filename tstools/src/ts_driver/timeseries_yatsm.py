@@ -1,6 +1,7 @@
 """ A basic timeseries driver for running YATSM on stacked timeseries
 """
 from datetime import datetime as dt
+import hashlib
 import itertools
 import logging
 import re
@@ -12,13 +13,27 @@ import sklearn
 import sklearn.externals.joblib as jl
 
 from . import timeseries_stacked
-from .timeseries import Series
+from . import ts_utils
+from .timeseries import Series, memoize
 from .ts_utils import find_files, parse_landsat_MTL
 from .. import settings
 
 logger = logging.getLogger('tstools')
 
 
+class CachedModel(object):
+    """ Results of a YATSM model read from the model cache
+
+    Args:
+      record (np.ndarray): structured array of model results
+      X (np.ndarray): design matrix of observations used by the model
+
+    """
+    def __init__(self, record, X):
+        self.record = record
+        self.X = X
+
+
 class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
     """ Timeseries driver for YATSM algorithm
     """
@@ -38,6 +53,9 @@ class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
     _max_values = [10000]
     _metadata_file_pattern = 'L*MTL.txt'
     _calc_pheno = False
+    _read_mode = 'thread'
+    _read_workers = 1
+    _prefetch_lines = 0
 
     config = ['_stack_pattern',
               '_date_index',
@@ -48,7 +66,10 @@ class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
               '_mask_band',
               '_min_values', '_max_values',
               '_metadata_file_pattern',
-              '_calc_pheno']
+              '_calc_pheno',
+              '_read_mode',
+              '_read_workers',
+              '_prefetch_lines']
     config_names = [
         'Stack pattern',
         'Date index',
@@ -59,7 +80,12 @@ class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
         'Mask band',
         'Min data values', 'Max data values',
         'Metadata file pattern',
-        'LTM phenology']
+        'LTM phenology',
+        'Read mode (serial/thread/process/block)',
+        'Read workers',
+        'Prefetch lines around query']
+
+    _inventory_patterns = ['_stack_pattern', '_metadata_file_pattern']
 
     # Driver controls
     _calculate_live = True
@@ -121,15 +147,20 @@ class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
         super(YATSMTimeSeries, self).__init__(location, config=config)
 
         # Check for YATSM imports
-        self._check_yatsm()
+        with ts_utils.profile_phase('import_yatsm'):
+            self._check_yatsm()
         # Find extra metadata
-        self._init_metadata()
+        with ts_utils.profile_phase('init_metadata'):
+            self._init_metadata()
 
         # Setup YATSM
         self.yatsm_model = None
         self.X = None
         self.Y = None
         self.coef_name = 'coef'
+        self._prediction = None
+        self._prediction_design_cache = (None, None)
+        self._design_matrix_cache = (None, None)
 
         # Setup min/max values
         if len(self._min_values) == 1:
@@ -153,9 +184,11 @@ class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
                     msg = 'Could not set {k} to {v} (current: {c})'.format(
                         k=k, v=v, c=current_value)
                     raise Exception(msg)
+        self.clear_memo()
 
     def fetch_results(self):
         """ Read or calculate results for current pixel """
+        self._prediction = None
         if self._calculate_live:
             self._fetch_results_live()
         else:
@@ -185,6 +218,15 @@ class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
                     self.series[0].pheno[idx[_sum]] = 'SUM'
                     self.series[0].pheno[idx[_aut]] = 'AUT'
 
+            # Predict all bands and segments once for plotting, keeping the
+            # model predicted so other threads never use another model's
+            model = self.yatsm_model
+            if len(model.record) > 0:
+                self._prediction = (model, self._predict(model=model))
+
+        self.clear_memo()
+
+    @memoize
     def get_prediction(self, series, band, dates=None):
         """ Return prediction for a given band
 
@@ -201,54 +243,24 @@ class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
         """
         if series > 0:
             return
-        if self.yatsm_model is None or len(self.yatsm_model.record) == 0:
+        model, prediction = self.yatsm_model, self._prediction
+        if model is None or len(model.record) == 0:
             return
-        if band >= self.yatsm_model.record[self.coef_name].shape[2]:
+        if band >= model.record[self.coef_name].shape[2]:
             logger.debug('Not results for band %i' % band)
             return
 
-        # Setup output
-        mx = []
-        my = []
-
-        # Don't predict with any categorical information
-        design = re.sub(r'[\+\-][\ ]+C\(.*\)', '', self._design)
-        coef_columns = []
-        for k, v in self._design_info.column_name_indexes.iteritems():
-            if not re.match('C\(.*\)', k):
-                coef_columns.append(v)
-        coef_columns = np.asarray(coef_columns)
-
-        for rec in self.yatsm_model.record:
-            # Check for reverse
-            if rec['end'] < rec['start']:
-                i_step = -1
-            else:
-                i_step = 1
-            # Date range to predict
-            if dates is not None:
-                end = max(rec['break'], rec['end'])
-                _mx = dates[np.where((dates >= rec['start']) &
-                                     (dates <= end))[0]]
-            else:
-                _mx = np.arange(rec['start'], rec['end'], i_step)
-
-            if _mx.size == 0:
-                continue
-            # Coefficients to use for prediction
-            _coef = rec[self.coef_name][coef_columns, band]
-            # Setup design matrix
-            _mX = patsy.dmatrix(design, {'x': _mx}).T
-            # Predict
-            _my = np.dot(_coef, _mX)
-            # Transform ordinal back to datetime for plotting
-            _mx = np.array([dt.fromordinal(int(_x)) for _x in _mx])
-
-            mx.append(_mx)
-            my.append(_my)
+        if dates is None and prediction is not None and \
+                prediction[0] is model:
+            mx, my = prediction[1]
+        else:
+            # Results may be replaced by a fit running in another thread, so
+            # predictions of any other model are not kept
+            mx, my = self._predict(dates, model=model)
 
-        return mx, my
+        return mx, [_my[:, band] for _my in my]
 
+    @memoize
     def get_breaks(self, series, band):
         """ Return break points for a given band
 
@@ -276,7 +288,8 @@ class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
                     if (index.size > 0 and
                             index[0] < self.series[series].data.shape[1]):
                         bx.append(_bx)
-                        by.append(self.series[series].data[band, index[0]])
+                        by.append(
+                            self.series[series].get_values()[band, index[0]])
                     else:
                         logger.warning('Could not determine breakpoint')
 
@@ -294,11 +307,16 @@ class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
             residual dates and values
 
         """
+        return self._get_residuals(series, band, settings.plot['mask'])
+
+    @memoize
+    def _get_residuals(self, series, band, mask):
+        """ Return residuals of data masked or left unmasked """
         if self.yatsm_model is None:
             return
         rx, ry = [], []
 
-        X, y = self.get_data(series, band, mask=settings.plot['mask'])
+        X, y = self.get_data(series, band, mask=mask)
         predict = self.get_prediction(series, band, dates=X['ordinal'])
         if predict is None:
             return
@@ -357,26 +375,194 @@ class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
         return artists
 
 # RESULTS HELPER METHODS
+    def _reset_results(self):
+        """ Forget results of the previous pixel """
+        self.yatsm_model = None
+        self._prediction = None
+
+    def _prediction_design(self):
+        """ Return design and coefficient indices used for prediction
+
+        Categorical terms are removed from the design since predictions
+        don't use them. The design used to build prediction design matrices
+        is cached for each `_design`.
+
+        Returns:
+          tuple: `patsy.DesignInfo` of design without categorical terms and
+            the indices (np.ndarray) of its coefficients in the model
+            coefficients
+
+        """
+        if self._prediction_design_cache[0] != self._design:
+            design = re.sub(r'[\+\-][\ ]+C\(.*\)', '', self._design)
+            design_info = patsy.dmatrix(design, {'x': np.zeros(1)}).design_info
+            self._prediction_design_cache = (self._design, design_info)
+        design_info = self._prediction_design_cache[1]
+
+        coef_columns = np.asarray([
+            v for k, v in self._design_info.column_name_indexes.iteritems()
+            if not re.match('C\(.*\)', k)])
+
+        return design_info, coef_columns
+
+    def _predict(self, dates=None, model=None):
+        """ Predict all bands for each segment of the model
+
+        The design matrix for every segment is built at once and predictions
+        for all bands are calculated with one matrix multiplication per
+        segment.
+
+        Args:
+          dates (np.ndarray): ordinal dates to predict; if None, predicts for
+            every date within each segment (default: None)
+          model (object): model to predict from; if None, predicts from
+            `yatsm_model` (default: None)
+
+        Returns:
+          tuple: lists of dates (np.ndarray of datetimes) and predictions
+            (np.ndarray of shape (ndate, nband)) for each segment
+
+        """
+        design_info, coef_columns = self._prediction_design()
+        model = model if model is not None else self.yatsm_model
+
+        segments, coefs = [], []
+        for rec in model.record:
+            if dates is not None:
+                end = max(rec['break'], rec['end'])
+                _mx = dates[(dates >= rec['start']) & (dates <= end)]
+            else:
+                # Check for reverse
+                i_step = -1 if rec['end'] < rec['start'] else 1
+                _mx = np.arange(rec['start'], rec['end'], i_step)
+            if _mx.size == 0:
+                continue
+            segments.append(_mx)
+            coefs.append(rec[self.coef_name][coef_columns, :])
+
+        if not segments:
+            return [], []
+
+        ordinals = np.concatenate(segments)
+        mX = np.asarray(patsy.build_design_matrices(
+            [design_info], {'x': ordinals})[0])
+        dates = ts_utils.ordinal2datetime(ordinals)
+
+        mx, my = [], []
+        i = 0
+        for _mx, _coef in zip(segments, coefs):
+            idx = slice(i, i + _mx.size)
+            mx.append(dates[idx])
+            my.append(np.dot(mX[idx], _coef))
+            i += _mx.size
+
+        return mx, my
+
     def _fetch_results_saved(self):
         """ Read YATSM results and return """
         raise NotImplementedError('No saved results reading just yet...')
 
+    def _model_cache_key(self):
+        """ Return key of model results for current pixel and parameters
+
+        Parameters include all custom controls and the data masking and
+        phenology configuration used to fit the model.
+
+        The model cache is shared by all drivers, so keys also identify the
+        driver class and the paths of the images fit.
+
+        Returns:
+          tuple: driver class name, key of image paths, column, row, and
+            digest of parameters
+
+        """
+        values = [getattr(self, k) for k in self.controls]
+        values.extend([self.mask_values, self._mask_band,
+                       self._min_values, self._max_values, self._calc_pheno])
+
+        sha = hashlib.sha1()
+        for v in values:
+            if isinstance(v, np.ndarray):
+                v = v.tolist()
+            sha.update(repr(v).encode('utf-8'))
+            sha.update(b'\n')
+
+        series = self.series[0]
+        return (type(self).__name__, series._images_key,
+                series.px, series.py, sha.hexdigest()[:16])
+
+    def _read_model_cache(self, key):
+        """ Return cached model results, if any
+
+        Args:
+          key (tuple): key of model results (see `_model_cache_key`)
+
+        Returns:
+          CachedModel or None: model results, or None if not cached
+
+        """
+        record = ts_utils.model_cache.get(key + ('record', ))
+        X = ts_utils.model_cache.get(key + ('X', ))
+        if record is None or X is None:
+            return None
+        return CachedModel(record, X)
+
+    def _write_model_cache(self, key, model):
+        """ Store model results in the model cache
+
+        Args:
+          key (tuple): key of model results (see `_model_cache_key`)
+          model (CCDCesque): fitted model
+
+        """
+        ts_utils.model_cache.put(key + ('record', ), model.record)
+        ts_utils.model_cache.put(key + ('X', ), np.asarray(model.X))
+
+    def _design_matrix(self):
+        """ Return design matrix of all images for the current `_design`
+
+        The design matrix only depends on the design and on the images, so it
+        is reused until `_design` changes.
+
+        Returns:
+          patsy.DesignMatrix: design matrix of all images in the first Series
+
+        """
+        if self._design_matrix_cache[0] != self._design:
+            X = patsy.dmatrix(self._design,
+                              {
+                                  'x': self.series[0].images['ordinal'],
+                                  'sensor': self.series[0].sensor,
+                                  'pr': self.series[0].pathrow
+                              })
+            self._design_matrix_cache = (self._design, X)
+        return self._design_matrix_cache[1]
+
     def _fetch_results_live(self):
-        """ Run YATSM and get results """
+        """ Run YATSM and get results
+
+        The model is fit without modifying the driver, which may be plotting
+        data from another thread, and the results are stored once the fit
+        finishes.
+        """
         logger.debug('Calculating YATSM results on the fly')
         # Setup design matrix, Y, and dates
-        self.X = patsy.dmatrix(self._design,
-                               {
-                                   'x': self.series[0].images['ordinal'],
-                                   'sensor': self.series[0].sensor,
-                                   'pr': self.series[0].pathrow
-                               })
-        self._design_info = self.X.design_info
-        self.Y = self.series[0].data.astype(np.int16)
-        self.dates = np.asarray(self.series[0].images['ordinal'])
-
-        mask = self.Y[self._mask_band[0] - 1, :]
-        Y_data = np.delete(self.Y, self._mask_band[0] - 1, axis=0)
+        X = self._design_matrix()
+        Y = self.series[0].data.astype(np.int16)
+        dates = np.asarray(self.series[0].images['ordinal'])
+
+        # Skip the fit if this pixel was fit with the same parameters
+        key = self._model_cache_key()
+        model = self._read_model_cache(key)
+        if model is not None:
+            logger.debug('Using cached YATSM model')
+            self.X, self.Y, self.dates = X, Y, dates
+            self._design_info = X.design_info
+            self.yatsm_model = model
+            return
+
+        mask = Y[self._mask_band[0] - 1, :]
+        Y_data = np.delete(Y, self._mask_band[0] - 1, axis=0)
 
         # Mask out masked values
         clear = np.in1d(mask, self.mask_values, invert=True)
@@ -416,40 +602,47 @@ class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
             dynamic_rmse=self._dynamic_rmse,
         )
 
-        self.yatsm_model = CCDCesque(lm=lm, **kwargs)
+        model = CCDCesque(lm=lm, **kwargs)
         # Don't want to have DEBUG logging when we run YATSM
         log_level = logger.level
         logger.setLevel(logging.INFO)
 
-        if self._reverse:
-            self.yatsm_model.fit(
-                np.flipud(self.X[clear, :]),
-                np.fliplr(Y_data[:, clear]),
-                np.fliplr(self.dates[clear]))
-        else:
-            self.yatsm_model.fit(
-                self.X[clear, :],
-                Y_data[:, clear],
-                self.dates[clear])
-
-        if self._commit_test:
-            self.yatsm_model.record = postprocess.commission_test(
-                self.yatsm_model, self._commit_alpha)
-
-        # if self._robust_results:
-        #     self.coef_name = 'robust_coef'
-        #     self.yatsm_model.record = postprocess.refit_record(
-        #         self.yatsm_model, 'robust'
-        # else:
-        #     self.coef_name = 'coef'
+        try:
+            if self._reverse:
+                model.fit(
+                    np.flipud(X[clear, :]),
+                    np.fliplr(Y_data[:, clear]),
+                    np.fliplr(dates[clear]))
+            else:
+                model.fit(
+                    X[clear, :],
+                    Y_data[:, clear],
+                    dates[clear])
+
+            if self._commit_test:
+                model.record = postprocess.commission_test(
+                    model, self._commit_alpha)
+
+            # if self._robust_results:
+            #     self.coef_name = 'robust_coef'
+            #     model.record = postprocess.refit_record(
+            #         model, 'robust'
+            # else:
+            #     self.coef_name = 'coef'
 
-        if self._calc_pheno:
-            # TODO: parameterize band indices & scale factor
-            ltm = pheno.LongTermMeanPhenology(self.yatsm_model)
-            self.yatsm_model.record = ltm.fit()
+            if self._calc_pheno:
+                # TODO: parameterize band indices & scale factor
+                ltm = pheno.LongTermMeanPhenology(model)
+                model.record = ltm.fit()
+        finally:
+            # Restore log level
+            logger.setLevel(log_level)
+
+        self._write_model_cache(key, model)
 
-        # Restore log level
-        logger.setLevel(log_level)
+        self.X, self.Y, self.dates = X, Y, dates
+        self._design_info = X.design_info
+        self.yatsm_model = model
 
 # SETUP
     def _init_metadata(self):
@@ -457,8 +650,11 @@ class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
         # Find MTL file
         self.mtl_files = None
         if self._metadata_file_pattern:
-            search = find_files(self.location, self._metadata_file_pattern,
-                                ignore_dirs=[self._results_folder])
+            search = self._files.get(self._metadata_file_pattern)
+            if search is None:
+                search = find_files(self.location,
+                                    self._metadata_file_pattern,
+                                    ignore_dirs=[self._results_folder])
             if len(search) == 0:
                 logger.error(
                     'Could not find image metadata with pattern {p}'.format(
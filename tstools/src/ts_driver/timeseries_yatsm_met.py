@@ -7,7 +7,6 @@ import os
 from . import ts_utils
 from .series import Series
 from .timeseries_yatsm import YATSMTimeSeries
-from ..logger import qgis_log
 
 logger = logging.getLogger('tstools')
 
@@ -44,11 +43,16 @@ class YATSMMetTimeSeries(YATSMTimeSeries):
             'tmax': [-30, 35]
         }
 
+        # Find all met data at once and split by type
+        logger.debug('Finding met data')
+        met_location = os.path.abspath(self._met_location)
+        with ts_utils.profile_phase('find_met'):
+            met_images = self._inventory(
+                met_location, [self._met_pattern])[self._met_pattern]
+
         for met_type in self._met_types:
-            logger.debug('Finding met data: %s' % met_type)
-            images = ts_utils.find_files(
-                os.path.join(self._met_location, met_type),
-                self._met_pattern)
+            root = os.path.join(met_location, met_type) + os.path.sep
+            images = [img for img in met_images if img.startswith(root)]
 
             # Get date index from file
             img = os.path.splitext(os.path.basename(images[0]))[0]
@@ -56,10 +60,10 @@ class YATSMMetTimeSeries(YATSMTimeSeries):
             try:
                 dt.datetime.strptime(d, self._met_date_format)
             except Exception as e:
-                qgis_log('Could not parse date from %ith "%s"-separated field '
-                         'of filename %s using date format %s: %s' %
-                         (self._met_date_sepno, self._met_date_sep,
-                          img, self._met_date_format, e.message))
+                logger.error('Could not parse date from %ith "%s"-separated '
+                             'field of filename %s using date format %s: %s' %
+                             (self._met_date_sepno, self._met_date_sep,
+                              img, self._met_date_format, e.message))
                 raise
             idx_start = img.find(d)
             self._met_date_index = (idx_start, idx_start + len(d))
@@ -71,7 +75,9 @@ class YATSMMetTimeSeries(YATSMTimeSeries):
                     'description': met_type,
                     'symbology_hint_indices': [0],
                     'cache_prefix': 'met_%s_' % met_type,
-                    'cache_suffix': '.npy'
+                    'cache_suffix': '.npy',
+                    'read_mode': self._read_mode,
+                    'read_workers': self._read_workers
                 }
             )
             if met_type in min_max_symbology:
@@ -8,7 +8,7 @@ import logging
 import os
 import pkgutil
 
-from ..logger import logger
+logger = logging.getLogger('tstools')
 
 
 class TSManager(object):
@@ -1,18 +1,170 @@
 """ Various utilities useful for timeseries drivers
 """
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime as dt
 import fnmatch
+import hashlib
+import json
 import logging
+from multiprocessing.pool import ThreadPool
 import os
+import struct
+import threading
+import time
 
 import numpy as np
 
 try:
-    from scandir import walk
+    from scandir import scandir
 except ImportError:
-    from os import walk
+    try:
+        from os import scandir
+    except ImportError:
+        scandir = None
 
 logger = logging.getLogger('tstools')
 
+_ORDINAL_EPOCH = dt(1970, 1, 1).toordinal()
+
+
+class FetchCancelled(Exception):
+    """ Raised when a fetch is cancelled using a `CancelToken` """
+    pass
+
+
+class CancelToken(object):
+    """ Flag, safe to share between threads, used to cancel a fetch
+
+    Readers check the token between reads and stop reading once it is
+    cancelled, raising `FetchCancelled`.
+
+    """
+    def __init__(self):
+        self._event = threading.Event()
+
+    @property
+    def cancelled(self):
+        """ bool: True if the token has been cancelled """
+        return self._event.is_set()
+
+    def cancel(self):
+        """ Cancel any fetch using this token """
+        self._event.set()
+
+    def check(self):
+        """ Raise `FetchCancelled` if the token has been cancelled
+
+        Raises:
+          FetchCancelled: raise FetchCancelled if cancelled
+
+        """
+        if self._event.is_set():
+            raise FetchCancelled('Fetch was cancelled')
+
+
+class LRUCache(object):
+    """ A least recently used cache of NumPy arrays bounded by size in bytes
+
+    Args:
+      max_bytes (int): maximum total size of arrays stored in the cache
+
+    Attributes:
+      hits (int): number of successful lookups
+      misses (int): number of unsuccessful lookups
+      nbytes (int): total size of arrays stored in the cache
+
+    """
+    def __init__(self, max_bytes=256 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        """ Return a copy of the array stored for `key`, or None if missing
+
+        Args:
+          key (hashable): key of array
+
+        Returns:
+          np.ndarray or None: copy of stored array, or None if not cached
+
+        """
+        with self._lock:
+            value = self._items.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items[key] = value
+            self.hits += 1
+        return value.copy()
+
+    def put(self, key, value):
+        """ Store a copy of an array, evicting least recently used arrays
+
+        Arrays larger than `max_bytes` are not stored.
+
+        Args:
+          key (hashable): key of array
+          value (np.ndarray): array to store
+
+        """
+        if value.nbytes > self.max_bytes:
+            return
+        value = value.copy()
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            while self._items and self.nbytes + value.nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+            self._items[key] = value
+            self.nbytes += value.nbytes
+
+    def clear(self):
+        """ Remove all arrays from the cache """
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+
+# In memory cache of pixel data shared by all Series
+pixel_cache = LRUCache()
+
+# In memory cache of model results shared by all drivers
+model_cache = LRUCache(max_bytes=32 * 1024 ** 2)
+
+# Seconds spent in each named phase of work, recorded by `profile_phase` when
+#   set to a dict (e.g., by `benchmark`)
+phase_timings = None
+
+
+@contextmanager
+def profile_phase(name):
+    """ Record time spent within a block as a named phase
+
+    Time is added to `phase_timings[name]` if `phase_timings` is a dict, and
+    otherwise not recorded.
+
+    Args:
+      name (str): name of phase
+
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        if isinstance(phase_timings, dict):
+            phase_timings[name] = (phase_timings.get(name, 0.0) +
+                                   time.time() - start)
+
 
 def check_cache(cache_folder):
     """ Checks location for ability to read/write from cache
@@ -46,27 +198,124 @@ def check_cache(cache_folder):
     return (read_cache, write_cache)
 
 
-def name_cache_pixel(x, y, shape, prefix='', suffix=''):
+def digest_image_IDs(image_IDs):
+    """ Return a short, stable digest of a sequence of image IDs
+
+    Args:
+      image_IDs (iterable): image IDs, in order
+
+    Returns:
+      str: hexadecimal digest
+
+    """
+    sha = hashlib.sha1()
+    for _id in image_IDs:
+        sha.update(str(_id).encode('utf-8'))
+        sha.update(b'\n')
+    return sha.hexdigest()[:16]
+
+
+# Pixel cache file format: a file header followed by fixed size records of
+#   magic (4 bytes), data size in bytes (uint32), column (int32), row (int32),
+#   and data (nband x ntime of `dtype`)
+_PIXEL_CACHE_MAGIC = b'TSPC'
+_PIXEL_CACHE_VERSION = 2
+_PIXEL_CACHE_HEADER = struct.Struct('<4sH8sII16s')
+_PIXEL_CACHE_RECORD_MAGIC = b'TSPR'
+_PIXEL_CACHE_RECORD = struct.Struct('<4sIii')
+
+# Index of records for each pixel cache file: {filename: (offset, {(x, y):
+#   offset})} where the first offset is the end of the last valid record
+_pixel_cache_index = {}
+_pixel_cache_lock = threading.Lock()
+
+
+def _strip_extension(suffix):
+    """ Return a cache filename suffix without any file extension """
+    # Prefixed so that a suffix such as ".npy" is not a hidden file name
+    return os.path.splitext('_' + suffix)[0][1:]
+
+
+def name_cache_pixel(shape, prefix='', suffix='', digest=''):
     """ Return a filename for a pixel cache file
 
+    One pixel cache file holds all pixels cached for a Series.
+
     Args:
-      x (int): column of pixel
-      y (int): row of pixel
       shape (tuple): shape of Y data to save
       prefix (str, optional): prefix to pixel cache filename
-      suffix (str, optional): suffix to pixel cache filename
+      suffix (str, optional): suffix to pixel cache filename. Any file
+        extension of the suffix (e.g., ".npy") is replaced by ".bin"
+      digest (str, optional): digest of image IDs in Series
 
     Returns:
       str: cache filename
 
     """
-    f = 'x%s_y%s_n%s_b%s' % (x, y, shape[1], shape[0])
+    f = 'pixels_n%s_b%s' % (shape[1], shape[0])
+    if digest:
+        f += '_' + digest
+
+    return prefix + f + _strip_extension(suffix) + '.bin'
+
+
+def _pixel_cache_header(series):
+    return _PIXEL_CACHE_HEADER.pack(
+        _PIXEL_CACHE_MAGIC, _PIXEL_CACHE_VERSION,
+        np.dtype(series.dtype).str.encode('ascii'),
+        series.count, series.n,
+        series.image_digest.encode('ascii'))
+
+
+def _pixel_cache_data_size(series):
+    return series.count * series.n * np.dtype(series.dtype).itemsize
 
-    return prefix + f + suffix + '.npz'
+
+def _index_cache_pixel(filename, f, series):
+    """ Update index of records in an open pixel cache file
+
+    Records are indexed until the end of the file or until a record that is
+    incomplete or does not begin with the record magic and data size
+    expected for `series`, such as a record left partially written.
+
+    Returns:
+      tuple: offset of the end of the last valid record, and the index of
+        records as {(x, y): offset of data}
+
+    """
+    data_size = _pixel_cache_data_size(series)
+    record_size = _PIXEL_CACHE_RECORD.size + data_size
+    offset, index = _pixel_cache_index.get(
+        filename, (_PIXEL_CACHE_HEADER.size, {}))
+
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    if size < offset:
+        # File was truncated or replaced; start over
+        offset, index = _PIXEL_CACHE_HEADER.size, {}
+    while offset + record_size <= size:
+        f.seek(offset)
+        magic, n, x, y = _PIXEL_CACHE_RECORD.unpack(
+            f.read(_PIXEL_CACHE_RECORD.size))
+        if magic != _PIXEL_CACHE_RECORD_MAGIC or n != data_size:
+            logger.warning('Ignoring invalid record in pixel cache file %s '
+                           'at offset %i' % (filename, offset))
+            break
+        index[(x, y)] = offset + _PIXEL_CACHE_RECORD.size
+        offset += record_size
+
+    _pixel_cache_index[filename] = (offset, index)
+    return offset, index
 
 
 def write_cache_pixel(filename, series):
-    """ Save one series data to NumPy zipped array
+    """ Append data for the current pixel of a Series to a pixel cache file
+
+    Data are stored in the native datatype of the Series (`series.dtype`).
+    The file is created with a header describing the Series if needed, or
+    replaced if its header does not match the Series. Anything after the
+    last valid record, such as a record left partially written, is removed
+    before the record is appended with a single write.
 
     Args:
       filename (str): filename of cache file
@@ -77,20 +326,36 @@ def write_cache_pixel(filename, series):
 
     """
     logger.debug('Caching pixel to %s' % filename)
-    np.savez(filename,
-             **{'Y': series.data,
-                'image_IDs': series.images['id']})
+    data = np.ascontiguousarray(series.data, dtype=series.dtype)
+    header = _pixel_cache_header(series)
+    record = (_PIXEL_CACHE_RECORD.pack(_PIXEL_CACHE_RECORD_MAGIC,
+                                       data.nbytes, series.px, series.py) +
+              data.tobytes())
+    with _pixel_cache_lock:
+        mode = 'r+b' if os.path.exists(filename) else 'w+b'
+        with open(filename, mode) as f:
+            if f.read(_PIXEL_CACHE_HEADER.size) == header:
+                end, _ = _index_cache_pixel(filename, f, series)
+            else:
+                _pixel_cache_index.pop(filename, None)
+                f.seek(0)
+                f.write(header)
+                end = _PIXEL_CACHE_HEADER.size
+            f.seek(end)
+            f.truncate()
+            f.write(record)
 
 
 def read_cache_pixel(filename, series):
-    """ Returns data read in from cache file if passes validation
+    """ Returns data for current pixel from cache file if passes validation
 
     Args:
       filename (str): filename of cache file
       series (Series): Series within timeseries driver to read
 
     Returns:
-      np.ndarray: 2D np.ndarray of 'Y' data for series
+      np.ndarray or None: 2D np.ndarray of 'Y' data for series, or None if
+        the current pixel of `series` is not in the cache file
 
     Raises:
       IOError: raise IOError if cache file cannot correctly be read from disk
@@ -98,44 +363,86 @@ def read_cache_pixel(filename, series):
         or images used in timeseries series
 
     """
-    z = np.load(filename)
-    if 'Y' not in z.files or 'image_IDs' not in z.files:
-        raise IndexError('Cache file is not in the correct format')
-
-    if np.array_equal(z['image_IDs'], series.images['id']):
-        return z['Y']
-    else:
-        raise IndexError('Could not find cache data for series %s. image_IDs '
-                         'are not the same' % series.description)
-
-
-def name_cache_line(y, shape, prefix='', suffix=''):
+    with _pixel_cache_lock:
+        with open(filename, 'rb') as f:
+            header = f.read(_PIXEL_CACHE_HEADER.size)
+            if header != _pixel_cache_header(series):
+                raise IndexError('Could not find cache data for series %s. '
+                                 'Cache file header does not match' %
+                                 series.description)
+            _, index = _index_cache_pixel(filename, f, series)
+            offset = index.get((series.px, series.py))
+            if offset is None:
+                return None
+            f.seek(offset)
+            data = np.fromfile(f, dtype=series.dtype,
+                               count=series.count * series.n)
+
+    return data.reshape(series.count, series.n)
+
+
+def name_cache_line(y, shape, prefix='', suffix='', digest=''):
     """ Return a filename for a line cache file
 
     Args:
       y (int): row of pixel
       shape (tuple): shape of Y data to save
       prefix (str, optional): prefix to pixel cache filename
-      suffix (str, optional): suffix to pixel cache filename
+      suffix (str, optional): suffix to line cache filename. Any file
+        extension of the suffix is replaced by ".npy"
+      digest (str, optional): digest of image IDs in Series
 
     Returns:
       str: cache filename
 
     """
     f = 'r%s_n%s_b%s' % (y, shape[1], shape[0])
+    if digest:
+        f += '_' + digest
 
-    return prefix + f + suffix + '.npz'
+    return prefix + f + _strip_extension(suffix) + '.npy'
+
+
+def name_cache_line_header(filename):
+    """ Return the filename of the header describing a line cache file
+
+    Args:
+      filename (str): filename of line cache file
+
+    Returns:
+      str: header filename
+
+    """
+    return os.path.splitext(filename)[0] + '.json'
+
+
+def write_cache_line_header(filename, series):
+    """ Save header identifying the images within a line cache file
+
+    Args:
+      filename (str): filename of line cache file
+      series (Series): Series within timeseries driver that was saved
+
+    Raises:
+      IOError: raise IOError if it cannot write to cache
+
+    """
+    with open(name_cache_line_header(filename), 'w') as f:
+        json.dump({'digest': series.image_digest}, f)
 
 
 def read_cache_line(filename, series):
     """ Returns data read in from cache file if passes validation
 
+    The data are memory mapped so that reading one pixel only reads the
+    parts of the file needed.
+
     Args:
       filename (str): filename of cache file
       series (Series): Series within timeseries driver to read
 
     Returns:
-      np.ndarray: 3D np.ndarray of 'Y' data for series
+      np.ndarray: 3D np.memmap (column, band, time) of 'Y' data for series
 
     Raises:
       IOError: raise IOError if cache file cannot correctly be read from disk
@@ -143,18 +450,24 @@ def read_cache_line(filename, series):
         or images used in timeseries series
 
     """
-    z = np.load(filename)
-    if 'Y' not in z.files or 'image_IDs' not in z.files:
+    with open(name_cache_line_header(filename)) as f:
+        header = json.load(f)
+    if 'digest' not in header:
         raise IndexError('Cache file is not in the correct format')
-
-    if np.array_equal(z['image_IDs'], series.images['id']):
-        return z['Y']
-    else:
+    if header['digest'] != series.image_digest:
         raise IndexError('Could not find cache data for series %s. image_IDs '
                          'are not the same' % series.description)
 
+    dat = np.load(filename, mmap_mode='r')
+    if dat.ndim != 3 or dat.shape[1:] != series.data.shape:
+        raise IndexError('Cache file dimensions do not match series %s' %
+                         series.description)
+
+    return dat
 
-def find_files(location, pattern, ignore_dirs=[], maxdepth=float('inf')):
+
+def find_files(location, pattern, ignore_dirs=[], maxdepth=float('inf'),
+               manifest=None):
     """ Find paths to images on disk matching an given pattern
 
     Args:
@@ -162,32 +475,258 @@ def find_files(location, pattern, ignore_dirs=[], maxdepth=float('inf')):
       pattern (str): glob style pattern to search for
       ignore_dirs (iterable): list of directories to ignore from search
       maxdepth (int): maximum depth to recursively search
+      manifest (str, optional): filename of manifest used to avoid listing
+        directories that have not changed (see `inventory_files`)
 
     Returns:
       list: list of files within location matching pattern
 
     """
-    results = []
+    return inventory_files(location, [pattern], ignore_dirs=ignore_dirs,
+                           maxdepth=maxdepth, manifest=manifest)[pattern]
+
+
+def name_inventory_manifest(location):
+    """ Return a filename for an inventory manifest of a directory
+
+    Args:
+      location (str): root directory of inventory
+
+    Returns:
+      str: manifest filename
+
+    """
+    location = os.path.abspath(location)
+    digest = hashlib.sha1(location.encode('utf-8')).hexdigest()[:16]
+    return 'inventory_%s.json' % digest
+
+
+def _list_dir(path, entry=None):
+    """ List directories and files within `path`
+
+    Args:
+      path (str): directory to list
+      entry (list, optional): previous listing of `path` as
+        [mtime, dirs, files], returned if `path` has not been modified since
+
+    Returns:
+      list: [mtime, dirs, files] of `path`
+
+    """
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return [None, [], []]
+    if entry is not None and entry[0] == mtime:
+        return entry
+
+    dirs, files = [], []
+    if scandir is not None:
+        for e in scandir(path):
+            try:
+                is_dir = e.is_dir()
+            except OSError:
+                is_dir = False
+            (dirs if is_dir else files).append(e.name)
+    else:
+        for name in os.listdir(path):
+            if os.path.isdir(os.path.join(path, name)):
+                dirs.append(name)
+            else:
+                files.append(name)
+
+    return [mtime, dirs, files]
+
+
+def inventory_files(location, patterns, ignore_dirs=[],
+                    maxdepth=float('inf'), manifest=None, workers=8):
+    """ Find paths to files matching any of several patterns in one walk
+
+    Directories at each depth are listed concurrently. If a manifest is
+    given, directories whose modification time matches the manifest are not
+    listed again, and the manifest is updated with any changes. Manifests
+    written by a search with different patterns, ignored directories, or
+    maximum depth are not used.
+
+    Args:
+      location (str): root directory to search
+      patterns (iterable): glob style patterns to search for
+      ignore_dirs (iterable): list of directories to ignore from search
+      maxdepth (int): maximum depth to recursively search
+      manifest (str, optional): filename of JSON manifest of directory
+        listings
+      workers (int): number of threads used to list directories
+
+    Returns:
+      dict: list of files within location matching each pattern
+
+    """
+    results = dict((pattern, []) for pattern in patterns)
 
     if isinstance(ignore_dirs, str):
         ignore_dirs = list(ignore_dirs)
 
-    location = os.path.normpath(location)
-    num_sep = location.count(os.path.sep) - 1
+    search = {
+        'patterns': sorted(patterns),
+        'ignore_dirs': sorted(ignore_dirs),
+        'maxdepth': None if maxdepth == float('inf') else maxdepth
+    }
+    listings = {}
+    if manifest and os.path.isfile(manifest):
+        try:
+            with open(manifest) as f:
+                saved = json.load(f)
+            if saved.get('search') == search:
+                listings = saved['listings']
+            else:
+                logger.debug('Inventory manifest %s is from a different '
+                             'search' % manifest)
+        except Exception as e:
+            logger.warning('Could not read inventory manifest %s: %s' %
+                           (manifest, e))
+            listings = {}
+    updated = {}
+
+    pool = ThreadPool(workers)
+    try:
+        depth = 1
+        level = [os.path.abspath(os.path.normpath(location))]
+        while level and depth <= maxdepth:
+            entries = pool.map(
+                lambda d: _list_dir(d, listings.get(d)), level)
+
+            next_level = []
+            for root, entry in zip(level, entries):
+                updated[root] = entry
+                _, dirs, files = entry
+                for pattern in patterns:
+                    for fname in fnmatch.filter(files, pattern):
+                        results[pattern].append(os.path.join(root, fname))
+                next_level.extend([os.path.join(root, d) for d in dirs
+                                   if d not in ignore_dirs])
+            level = next_level
+            depth += 1
+    finally:
+        pool.close()
+
+    if manifest and updated != listings:
+        try:
+            with open(manifest, 'w') as f:
+                json.dump({'search': search, 'listings': updated}, f)
+        except Exception as e:
+            logger.warning('Could not write inventory manifest %s: %s' %
+                           (manifest, e))
+
+    for pattern in patterns:
+        results[pattern].sort()
 
-    for root, dirs, files in walk(location, followlinks=True):
-        if ignore_dirs:
-            dirs[:] = [d for d in dirs if d not in ignore_dirs]
+    return results
 
-        depth = root.count(os.path.sep) - num_sep
-        if depth > maxdepth:
-            dirs[:] = []
-            files[:] = []
 
-        for fname in fnmatch.filter(files, pattern):
-            results.append(os.path.abspath(os.path.join(root, fname)))
+# Width of date format directives supported by `parse_dates`
+_DATE_DIRECTIVES = {'Y': 4, 'm': 2, 'd': 2, 'j': 3}
 
-    return results
+
+def _date_fields(date_format):
+    """ Return (directive, start, end) of each part of a date format
+
+    Literal characters are returned with their character as the directive,
+    prefixed by "=". Returns None if `date_format` contains directives other
+    than those within `_DATE_DIRECTIVES`.
+    """
+    fields, pos, i = [], 0, 0
+    while i < len(date_format):
+        if date_format[i] == '%':
+            width = _DATE_DIRECTIVES.get(date_format[i + 1:i + 2])
+            if width is None:
+                return None
+            fields.append((date_format[i + 1], pos, pos + width))
+            pos += width
+            i += 2
+        else:
+            fields.append(('=' + date_format[i], pos, pos + 1))
+            pos += 1
+            i += 1
+    return fields
+
+
+def parse_dates(strings, date_format):
+    """ Parse dates from strings using vectorized NumPy operations
+
+    Supports fixed width date formats built from the "%Y", "%m", "%d", and
+    "%j" directives and literal characters (e.g., "%Y%j" or "%Y-%m-%d").
+
+    Args:
+      strings (iterable): strings containing only a date
+      date_format (str): format of dates
+
+    Returns:
+      np.ndarray: dates as `datetime64[D]`
+
+    Raises:
+      ValueError: raise ValueError if the format is unsupported or if any
+        string does not contain a valid date in `date_format`
+
+    """
+    fields = _date_fields(date_format)
+    if not fields:
+        raise ValueError('Unsupported date format %s' % date_format)
+    width = fields[-1][2]
+
+    strings = np.asarray(strings, dtype='S')
+    if strings.dtype.itemsize != width:
+        raise ValueError('Dates are not of format %s' % date_format)
+    chars = strings.view(np.uint8).reshape(strings.size, width)
+
+    values = {}
+    for directive, start, end in fields:
+        if directive.startswith('='):
+            if np.any(chars[:, start] != ord(directive[1])):
+                raise ValueError('Dates are not of format %s' % date_format)
+            continue
+        digits = chars[:, start:end].astype(np.int64) - ord('0')
+        if np.any((digits < 0) | (digits > 9)):
+            raise ValueError('Dates are not of format %s' % date_format)
+        values[directive] = digits.dot(10 ** np.arange(end - start)[::-1])
+
+    if 'Y' not in values:
+        raise ValueError('Date format %s does not contain a year' %
+                         date_format)
+    years = (values['Y'] - 1970).astype('M8[Y]')
+    if 'j' in values:
+        doy = values['j']
+        n_days = ((years + 1).astype('M8[D]') -
+                  years.astype('M8[D]')).astype(np.int64)
+        if np.any((doy < 1) | (doy > n_days)):
+            raise ValueError('Invalid day of year in dates')
+        return years.astype('M8[D]') + (doy - 1).astype('m8[D]')
+
+    month = values.get('m', np.ones_like(values['Y']))
+    day = values.get('d', np.ones_like(values['Y']))
+    if np.any((month < 1) | (month > 12)):
+        raise ValueError('Invalid month in dates')
+    months = years.astype('M8[M]') + (month - 1).astype('m8[M]')
+    n_days = ((months + 1).astype('M8[D]') -
+              months.astype('M8[D]')).astype(np.int64)
+    if np.any((day < 1) | (day > n_days)):
+        raise ValueError('Invalid day of month in dates')
+    return months.astype('M8[D]') + (day - 1).astype('m8[D]')
+
+
+def ordinal2datetime(ordinals):
+    """ Convert ordinal dates to datetimes using vectorized NumPy operations
+
+    Args:
+      ordinals (np.ndarray): proleptic Gregorian ordinal dates (see
+        `datetime.date.toordinal`)
+
+    Returns:
+      np.ndarray: `datetime.datetime` objects (dtype object)
+
+    """
+    ordinals = np.asarray(ordinals, dtype=np.int64)
+    return ((ordinals - _ORDINAL_EPOCH).astype('M8[D]')
+            .astype('M8[us]').astype(object))
 
 
 def set_custom_config(obj, values):
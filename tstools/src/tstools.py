@@ -158,6 +158,8 @@ class TSTools(QtCore.QObject):
         """ Shutdown and disconnect """
         # Disconnect
         self.controller.disconnect()
+        if tsm.ts is not None:
+            tsm.ts.close()
         tsm.ts = None
         # Remove toolbar icons
         self.iface.removeToolBarIcon(self.action)